@@ -137,6 +137,14 @@ python box_split_ff0000.py \
   --margin 2 --rmin 220 --gmax 40 --bmax 40 --dilate 5 \
   --edge-thresh 0.05 --max-search 0.20
 
+# Same page, all settings at once: ranked table + overlays of the top 5 in the out folder
+python box_split_ff0000.py \
+  --input "/Users/dlan/Album Memories 04 PySplit/Album Memories 04 marked/Album Memories 04_003.JPG" \
+  --out "/Users/dlan/Album Memories 04 MarkedSweep" \
+  --sweep --target-boxes 4 \
+  --rmin 220,235 --gmax 40,25 --bmax 40,25 --dilate 5,7 \
+  --edge-thresh 0.05,0.2 --max-search 0.20,0.25 --margin 2,8
+
 pip install opencv-python
 
 # Correct a whole folder (recursively), writing results to OUT (mirrors subfolders)
@@ -150,6 +158,12 @@ python convert_tif_to_jpg.py --input "Users/dlan/Pictures/Corrected" --recursive
 # Correct a single image
 python auto_correct_photos.py --input "/path/to/photo.jpg" --out "/path/to/out"
 
+# _ac, _bw and _fixed variants in one pass (each file decoded once)
+python auto_correct_multi.py \
+  --input "/Users/dlan/Album Memories 06 Split" \
+  --out "/Users/dlan/Album Memories 06 Split Corrected" \
+  --recursive --jobs 0 --fixed-args="--max-yellow-frac 0.55"
+
 python auto_correct_bw.py \
   --input "/Users/dlan/Album Memories 06 Split" \
   --out "/Users/dlan/Album Memories 06 Split Corrected Smart" \
@@ -160,3 +174,7 @@ python auto_correct_bw.py \
 
 
   python batch_nano_banana.py -i "/Users/david/Pictures/6401/1928 to 1939" -o "/Users/david/Pictures/6401/1928 to 1939 Color"
+
+# Whole album as one Gemini batch job: write the requests, submit them, then ingest the results
+python batch_nano_banana.py prepare -i "/Users/david/Pictures/6401/1928 to 1939" -o "/Users/david/Pictures/6401/1928 to 1939 Color" --max-edge 3072 --shard-mb 1500
+python batch_nano_banana.py ingest -o "/Users/david/Pictures/6401/1928 to 1939 Color" --results "results.jsonl"
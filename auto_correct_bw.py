@@ -33,80 +33,41 @@ Options
 --preview          : write a side-by-side preview of original and result
 --format           : force output format (jpg/png/tiff). Default: keep input's
 --quality          : JPEG quality (default 92)
+--jobs             : worker processes (default 1; 0 = all cores)
+--force            : reprocess files the skip manifest says are unchanged
 
 Note: OpenCV writes 8-bit; if you need 16-bit TIFFs, say the word and I'll add it.
 """
 
-import os, sys, argparse, glob
+import os, sys, argparse
 from typing import List, Tuple
 import numpy as np
 import cv2
 
-def imread_color(path: str):
-    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-    if img is None:
-        img = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img is None:
-        raise FileNotFoundError(f"Could not read: {path}")
-    return img
-
-def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
-
-def list_images(root: str, exts: List[str], recursive: bool) -> List[str]:
-    if os.path.isfile(root): return [root]
-    pats = []
-    for e in exts:
-        pats += [f"**/*.{e}", f"**/*.{e.upper()}"] if recursive else [f"*.{e}", f"*.{e.upper()}"]
-    files: List[str] = []
-    for pat in pats:
-        files.extend(glob.glob(os.path.join(root, pat), recursive=recursive))
-    files = [f for f in files if os.path.isfile(f)]
-    files.sort()
-    return files
-
-def resize_max_edge(img: np.ndarray, max_edge: int) -> np.ndarray:
-    if max_edge <= 0: return img
-    h, w = img.shape[:2]; m = max(h, w)
-    if m <= max_edge: return img
-    s = max_edge / float(m)
-    return cv2.resize(img, (int(round(w*s)), int(round(h*s))), interpolation=cv2.INTER_AREA)
+from batch_pool import run_tasks
+from skip_cache import SkipManifest, effective_params
+from correct_pipeline import (Stage, StageCache, GRAY, clahe, levels, denoise, unsharp, run_chain,
+                              imread_color, ensure_dir, list_images, resize_max_edge, out_path_for,
+                              imwrite_params)
 
 # ---- Enhancements ----
-def to_gray(img_bgr: np.ndarray) -> np.ndarray:
-    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-
-def auto_levels_gray(gray: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
-    g = gray.astype(np.float32)
-    lo = float(np.quantile(g, low_q)); hi = float(np.quantile(g, high_q))
-    if hi > lo + 1e-6:
-        g = np.clip((g - lo) * (255.0 / (hi - lo)), 0, 255)
-    return g.astype(np.uint8)
-
-def apply_clahe(gray: np.ndarray, clip=2.2, tile=(8,8)) -> np.ndarray:
-    clahe = cv2.createCLAHE(clipLimit=float(clip), tileGridSize=tuple(map(int, tile)))
-    return clahe.apply(gray)
-
-def unsharp_mask(gray: np.ndarray, amount=0.5, radius=1.2) -> np.ndarray:
-    if amount <= 0: return gray
-    blur = cv2.GaussianBlur(gray, (0,0), radius)
-    sharp = cv2.addWeighted(gray, 1.0 + amount, blur, -amount, 0)
-    return np.clip(sharp, 0, 255).astype(np.uint8)
-
-def fast_denoise(gray: np.ndarray, strength=0.0) -> np.ndarray:
-    if strength <= 0: return gray
-    h = float(strength)
-    return cv2.fastNlMeansDenoising(gray, None, h, 7, 21)
-
-def bw_fix(img_bgr: np.ndarray, args) -> np.ndarray:
-    g = to_gray(img_bgr)
+def stages(args) -> List[Stage]:
+    st = [GRAY]
     if args.clahe:
-        g = apply_clahe(g, clip=args.clip_limit, tile=args.tile)
-    g = auto_levels_gray(g, args.low_q, args.high_q)
+        st.append(clahe(args.clip_limit, args.tile))
+    st.append(levels(args.low_q, args.high_q))
     if args.denoise > 0:
-        g = fast_denoise(g, args.denoise)
+        st.append(denoise(args.denoise))
     if args.sharpen > 0:
-        g = unsharp_mask(g, amount=args.sharpen, radius=1.2)
-    return g
+        st.append(unsharp(args.sharpen, 1.2))
+    return st
+
+def chains(args) -> List[List[Stage]]:
+    """Every stage chain render() may run (lets auto_correct_multi.py plan shared prefixes)."""
+    return [stages(args)]
+
+def bw_fix(img_bgr: np.ndarray, args) -> np.ndarray:
+    return run_chain(img_bgr, stages(args))
 
 def side_by_side(a: np.ndarray, b_gray: np.ndarray, max_h=800) -> np.ndarray:
     def resize_h(x, h):
@@ -117,28 +78,28 @@ def side_by_side(a: np.ndarray, b_gray: np.ndarray, max_h=800) -> np.ndarray:
     pad = np.ones((max_h, 16, 3), np.uint8) * 255
     return np.hstack([a2, pad, b3])
 
-def process_one(src: str, dst: str, args):
-    img = imread_color(src)
-    if args.max_edge > 0:
-        img = resize_max_edge(img, args.max_edge)
-    out = bw_fix(img, args)
-
-    ext = args.format.lower() if args.format else os.path.splitext(dst)[1][1:].lower()
-    params = []
-    if ext in ("jpg", "jpeg"):
-        params = [int(cv2.IMWRITE_JPEG_QUALITY), int(args.quality)]
-    elif ext == "png":
-        params = [int(cv2.IMWRITE_PNG_COMPRESSION), 3]
+def outputs(dst: str, args, rec=None) -> List[str]:
+    """Every file render() writes for `dst` (what the skip manifest checks and records)."""
+    return [dst] + ([os.path.splitext(dst)[0] + "_preview.jpg"] if args.preview else [])
 
+def render(cache: StageCache, src: str, dst: str, args):
+    out = cache.run(stages(args))
     ensure_dir(os.path.dirname(dst))
-    cv2.imwrite(dst, out, params)
+    cv2.imwrite(dst, out, imwrite_params(dst, args.quality, args.format))
 
     if args.preview:
-        pre = os.path.splitext(dst)[0] + "_preview.jpg"
-        combo = side_by_side(img, out, 800)
+        pre = outputs(dst, args)[1]
+        combo = side_by_side(cache.img, out, 800)
         cv2.imwrite(pre, combo, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
 
-def main():
+def process_one(src: str, dst: str, args):
+    render(StageCache(resize_max_edge(imread_color(src), args.max_edge)), src, dst, args)
+
+def _tile(s: str) -> Tuple[int, int]:
+    parts = [int(x) for x in s.split(",")]
+    return (parts[0], parts[1])
+
+def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Convert photos to clean B&W (grayscale) with gentle enhancement.")
     ap.add_argument("--input", required=True, help="Image file or directory")
     ap.add_argument("--out", required=True, help="Output directory")
@@ -150,19 +111,21 @@ def main():
     ap.add_argument("--quality", type=int, default=92, help="JPEG quality if writing JPG")
     ap.add_argument("--max-edge", type=int, default=0, help="Optionally downscale so longest edge <= this (0=off)")
     ap.add_argument("--preview", action="store_true", help="Write side-by-side (original|B&W) preview images")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = all cores, 1 = serial)")
+    ap.add_argument("--force", action="store_true", help="Reprocess every file, ignoring the skip manifest in the output root")
 
     # Enhancement knobs (good defaults)
     ap.add_argument("--low-q", type=float, default=0.01)
     ap.add_argument("--high-q", type=float, default=0.99)
     ap.add_argument("--clahe", action="store_true", default=True)
     ap.add_argument("--clip-limit", type=float, default=2.2)
-    ap.add_argument("--tile", default="8,8", help="CLAHE tile grid, e.g., '8,8'")
+    ap.add_argument("--tile", type=_tile, default="8,8", help="CLAHE tile grid, e.g., '8,8'")
     ap.add_argument("--sharpen", type=float, default=0.5, help="Unsharp mask amount (0 disables)")
     ap.add_argument("--denoise", type=float, default=0.0, help="Fast denoise strength (0 disables)")
+    return ap
 
-    args = ap.parse_args()
-    tile_parts = [int(x) for x in args.tile.split(",")]
-    args.tile = (tile_parts[0], tile_parts[1])
+def main():
+    args = build_parser().parse_args()
 
     exts = [e.strip().lower() for e in args.extensions.split(",") if e.strip()]
     # Gather files
@@ -178,21 +141,23 @@ def main():
     out_root = os.path.abspath(args.out)
     ensure_dir(out_root)
 
-    total = len(files)
-    for idx, src in enumerate(files, 1):
-        rel = os.path.relpath(src, in_root) if os.path.isdir(args.input) else os.path.basename(src)
-        base, ext = os.path.splitext(rel)
-        if args.inplace:
-            dst_rel = rel if not args.format else base + "." + args.format.lower()
-        else:
-            dst_rel = base + args.suffix + "." + (args.format.lower() if args.format else ext[1:].lower())
-        dst = os.path.join(out_root, dst_rel)
+    tasks = [(src, out_path_for(src, args.input, in_root, out_root, args.suffix, args.format, args.inplace), args)
+             for src in files]
+
+    # Skip inputs that are unchanged since they were last converted with these settings
+    manifest = SkipManifest(out_root, "auto_correct_bw", effective_params(args), enabled=not args.force)
+    todo = [t for t in tasks if manifest.check(t[0], outputs(t[1], args)) is None]
+    if len(todo) < len(tasks):
+        print(f"Skipping {len(tasks) - len(todo)} unchanged file(s) (use --force to redo them).")
 
+    total = len(todo)
+    for idx, ((src, dst, _), _, err) in enumerate(run_tasks(process_one, todo, args.jobs), 1):
         print(f"[{idx}/{total}] {src} -> {dst}")
-        try:
-            process_one(src, dst, args)
-        except Exception as e:
-            print(f"  ! Error: {e}")
+        if err:
+            print(f"  ! Error: {err.splitlines()[0]}")
+        else:
+            manifest.record(src, outputs(dst, args))
+    manifest.save()
 
     print(f"Done. Processed {total} file(s). Output root: {out_root}")
 
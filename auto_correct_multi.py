@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+auto_correct_multi.py — Several correctors in ONE pass: decode each file once.
+
+Runs any of the correctors below over the same input, glob and decode (and
+--max-edge resize) per file shared, and correction stages common to several
+variants (gray-world WB, gray+CLAHE...) computed once (see correct_pipeline.py):
+
+    ac    -> auto_correct_photos.py   (<name>_ac.<ext>)
+    bw    -> auto_correct_bw.py       (<name>_bw.<ext>)
+    fixed -> auto_correct_smart.py    (<name>_fixed.<ext>, + its JSONL log and metrics store)
+
+Outputs, skip manifests and the smart log are exactly those of the single
+scripts run with the same --out, so either can pick up where the other left off.
+
+Examples
+--------
+python auto_correct_multi.py --input "/path/to/folder" --out "/path/to/out" --recursive --jobs 0
+
+# Per-variant options go in a quoted string (note the '='), parsed by that script's own parser
+python auto_correct_multi.py --input in/ --out out/ --variants bw,fixed \\
+  --bw-args="--sharpen 0.3 --preview" --fixed-args="--proxy-edge 1024 --max-yellow-frac 0.55"
+"""
+
+import os, sys, argparse, json, shlex, traceback
+from typing import Dict, List, Tuple
+
+import auto_correct_photos, auto_correct_bw, auto_correct_smart
+from batch_pool import run_tasks
+from correct_pipeline import StageCache, imread_color, ensure_dir, list_images, resize_max_edge, out_path_for
+from skip_cache import SkipManifest, effective_params
+
+# variant -> (module, manifest name, effective_params ignore list)
+VARIANTS = {
+    "ac": (auto_correct_photos, "auto_correct_photos", ()),
+    "bw": (auto_correct_bw, "auto_correct_bw", ()),
+    "fixed": (auto_correct_smart, "auto_correct_smart", auto_correct_smart.NOT_STORED),
+}
+
+def variant_args(name: str, args) -> argparse.Namespace:
+    """Parse the shared options + --<name>-args with the variant script's own parser."""
+    argv = ["--input", args.input, "--out", args.out, "--extensions", args.extensions,
+            "--format", args.format, "--quality", str(args.quality), "--max-edge", str(args.max_edge)]
+    if args.recursive: argv.append("--recursive")
+    ap = VARIANTS[name][0].build_parser()
+    vargs = ap.parse_args(argv + shlex.split(getattr(args, f"{name}_args")))
+    if vargs.inplace:
+        ap.error("--inplace is not supported in a multi-variant run")
+    if getattr(vargs, "reclassify", False) or getattr(vargs, "proxy_report", False):
+        ap.error("--reclassify/--proxy-report: run auto_correct_smart.py directly")
+    return vargs
+
+def process_file(src: str, jobs: List[Tuple[str, str, argparse.Namespace]]) -> Dict[str, Tuple]:
+    """Decode `src` once and render each (variant, dst, args); returns {variant: (record, error)}."""
+    img = imread_color(src)
+    by_edge: Dict[int, List] = {}
+    for job in jobs:
+        by_edge.setdefault(job[2].max_edge, []).append(job)
+    out = {}
+    for edge, group in by_edge.items():
+        plan = [c for name, _, vargs in group for c in VARIANTS[name][0].chains(vargs)]
+        cache = StageCache(resize_max_edge(img, edge), plan)
+        for name, dst, vargs in group:
+            try:
+                out[name] = (VARIANTS[name][0].render(cache, src, dst, vargs), None)
+            except Exception as e:
+                out[name] = (None, f"{e}\n{traceback.format_exc()}")
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Run several correctors over one decode per file.")
+    ap.add_argument("--input", required=True, help="Image file or directory")
+    ap.add_argument("--out", required=True, help="Output directory")
+    ap.add_argument("--variants", default="ac,bw,fixed", help="Comma list of: " + ",".join(VARIANTS))
+    ap.add_argument("--recursive", action="store_true", help="Recurse into subfolders")
+    ap.add_argument("--extensions", default="jpg,jpeg,png,tif,tiff,bmp", help="Comma list of extensions to include")
+    ap.add_argument("--format", default="", help="Force output format (jpg/png/tiff). Default: keep input extension")
+    ap.add_argument("--quality", type=int, default=92, help="JPEG quality when writing JPG")
+    ap.add_argument("--max-edge", type=int, default=0, help="Downscale so longest edge <= this (0=off); a variant may override it")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = all cores, 1 = serial)")
+    ap.add_argument("--force", action="store_true", help="Reprocess every file, ignoring the skip manifests in the output root")
+    for name, (mod, _, _) in VARIANTS.items():
+        ap.add_argument(f"--{name}-args", default="", help=f"Extra options for {mod.__name__}.py, e.g. --{name}-args=\"--preview\"")
+    args = ap.parse_args()
+
+    names = [v.strip() for v in args.variants.split(",") if v.strip()]
+    unknown = [v for v in names if v not in VARIANTS]
+    if unknown or not names:
+        ap.error(f"--variants: unknown {', '.join(unknown) or '(none given)'}; choose from {', '.join(VARIANTS)}")
+    vargs = {n: variant_args(n, args) for n in names}
+
+    exts = [e.strip().lower() for e in args.extensions.split(",") if e.strip()]
+    files = list_images(args.input, exts, args.recursive)
+    if not files:
+        print("No input images found."); return
+    in_root = os.path.abspath(args.input if os.path.isdir(args.input) else os.path.dirname(args.input))
+    out_root = os.path.abspath(args.out); ensure_dir(out_root)
+
+    manifests = {n: SkipManifest(out_root, VARIANTS[n][1], effective_params(vargs[n], ignore=VARIANTS[n][2]),
+                                 enabled=not args.force) for n in names}
+    # Per file: which variants are already up to date (with their stored entry) and which need work
+    tasks, hits = [], []
+    for src in files:
+        jobs, hit = [], {}
+        for n in names:
+            dst = out_path_for(src, args.input, in_root, out_root, vargs[n].suffix, vargs[n].format)
+            e = manifests[n].check(src, VARIANTS[n][0].outputs(dst, vargs[n]))
+            if e is None: jobs.append((n, dst, vargs[n]))
+            else: hit[n] = e
+        tasks.append((src, jobs)); hits.append(hit)
+    todo = [t for t in tasks if t[1]]
+    skipped = sum(len(h) for h in hits)
+    if skipped:
+        print(f"Skipping {skipped} unchanged file/variant pair(s) (use --force to redo them).")
+
+    # The smart corrector's log and metrics store, in input order like a single run
+    smart = "fixed" in names
+    log_path = os.path.join(out_root, "auto_correct_smart.log.jsonl")
+    log_fh = open(log_path, "w") if smart else None
+    records = []
+    results = run_tasks(process_file, todo, args.jobs)
+    done = 0
+    for (src, jobs), hit in zip(tasks, hits):
+        res = {}
+        if jobs:
+            _, res, err = next(results); done += 1
+            print(f"[{done}/{len(todo)}] {src} -> {', '.join(n for n, _, _ in jobs)}")
+            if err:
+                res = {n: (None, err) for n, _, _ in jobs}
+        for n, dst, _ in jobs:
+            rec, verr = res[n]
+            if verr:
+                print(f"  ! {n}: {verr.splitlines()[0]}")
+                rec = {"file": src, "out": dst, "error": verr.splitlines()[0]} if n == "fixed" else None
+            else:
+                manifests[n].record(src, VARIANTS[n][0].outputs(dst, vargs[n], rec), rec)
+            hit[n] = {"record": rec}
+        if smart:
+            records.append(hit["fixed"]["record"])
+            log_fh.write(json.dumps(records[-1]) + "\n"); log_fh.flush()
+    for m in manifests.values():
+        m.save()
+    if smart:
+        log_fh.close()
+        auto_correct_smart.write_metrics_store(os.path.join(out_root, auto_correct_smart.STORE_NAME), records,
+                                               effective_params(vargs["fixed"], ignore=auto_correct_smart.NOT_STORED))
+
+    print(f"Done. Processed {len(todo)} file(s) for variant(s) {', '.join(names)}. Output: {out_root}")
+
+if __name__ == "__main__":
+    main()
@@ -19,59 +19,133 @@ pip install opencv-python
 
 python auto_correct_smart.py \
   --input "/path/to/folder" --out "/path/to/out" --recursive --preview
+
+# Use every core (--jobs 0); the JSONL log is still written in input order
+python auto_correct_smart.py --input "/path/to/folder" --out "/path/to/out" --recursive --jobs 0
+
+# Decide colour vs B&W on a 1024px proxy, render only the winner at full res;
+# check first how often that changes the decision on your corpus
+python auto_correct_smart.py --input "/path/to/folder" --out "/path/to/out" --recursive \
+  --proxy-edge 1024 --proxy-report
+
+Re-runs are incremental: a manifest in the output root skips inputs that are
+unchanged and were processed with the same settings (their previous log records
+are carried into the new log). --force reprocesses everything.
+
+Threshold sweeps
+----------------
+Each run also writes auto_correct_smart.metrics.npz (one column per logged metric).
+--reclassify re-applies any threshold set to it in milliseconds, prints the
+B&W/colour flips and re-renders only the files whose decision changed:
+
+python auto_correct_smart.py --out "/path/to/out" --reclassify --max-yellow-frac 0.55 --dry-run
 """
 
-import os, sys, argparse, glob, json
+import os, sys, argparse, json, time
 from typing import List, Dict, Tuple
 import numpy as np
 import cv2
 
-# ---------------- IO ----------------
-def imread_color(path: str):
-    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-    if img is None:
-        img = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img is None:
-        raise FileNotFoundError(f"Could not read: {path}")
-    return img
-
-def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
-
-def list_images(root: str, exts: List[str], recursive: bool) -> List[str]:
-    if os.path.isfile(root):
-        return [root]
-    pats = []
-    for e in exts:
-        pats += [f"**/*.{e}", f"**/*.{e.upper()}"] if recursive else [f"*.{e}", f"*.{e.upper()}"]
-    files: List[str] = []
-    for pat in pats:
-        files.extend(glob.glob(os.path.join(root, pat), recursive=recursive))
-    files = [f for f in files if os.path.isfile(f)]
-    files.sort()
-    return files
-
-def resize_max_edge(img: np.ndarray, max_edge: int) -> np.ndarray:
-    if max_edge <= 0: return img
-    h, w = img.shape[:2]; m = max(h, w)
-    if m <= max_edge: return img
-    s = max_edge / float(m)
-    return cv2.resize(img, (int(round(w*s)), int(round(h*s))), interpolation=cv2.INTER_AREA)
+from batch_pool import run_tasks
+from levels_lut import hist_quantile
+from skip_cache import SkipManifest, effective_params
+from correct_pipeline import (Stage, StageCache, WB, GRAY, GRAY_BGR, clahe, de_yellow, saturation, levels,
+                              run_chain, apply_clahe, gray_to_bgr, imread_color, ensure_dir, list_images,
+                              resize_max_edge, out_path_for, imwrite_params)
+
+# --------------- Shared colour-space analysis ---------------
+# Sample values of a uint8 plane as the old float32 code saw them; histogram bin i
+# holds the pixels whose value is _U8[i], so every reduction below is a weighted
+# sum over at most 256 (or 256x256) bins instead of a pass over the full frame.
+_U8 = np.arange(256, dtype=np.float32)
+_UNIT = _U8 / 255.0
+_CENTRED = _U8 - 128.0
+_CHROMA = np.sqrt(_CENTRED[:, None]**2 + _CENTRED[None, :]**2)  # [a, b]
+
+def _hist_mean_std(counts: np.ndarray, values: np.ndarray) -> Tuple[float, float]:
+    n = float(counts.sum())
+    v = values.astype(np.float64)
+    mean = float(np.dot(counts, v)) / n
+    var = float(np.dot(counts, (v - mean)**2)) / n
+    return mean, float(np.sqrt(var))
+
+class ColorAnalysis:
+    """Colour spaces and histograms of one image, each computed at most once.
+
+    The metric functions below take an optional `an`; pass the same object to all
+    of them so HSV/Lab/gray are converted once (uint8, no float32 copies) and the
+    mean/std/quantile/histogram reductions all read the same per-plane histograms,
+    which are filled in a single strip-wise pass.
+    """
+    def __init__(self, img_bgr: np.ndarray, strip_rows: int = 512):
+        self.img = img_bgr
+        self.strip_rows = strip_rows
+        self._cache: Dict = {}
+
+    def _memo(self, key, fn):
+        if key not in self._cache: self._cache[key] = fn()
+        return self._cache[key]
+
+    @property
+    def hsv(self) -> np.ndarray:
+        return self._memo("hsv", lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2HSV))
+
+    @property
+    def lab(self) -> np.ndarray:
+        return self._memo("lab", lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2LAB))
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self._memo("gray", lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY))
+
+    def _strips(self):
+        for y in range(0, self.img.shape[0], self.strip_rows):
+            yield slice(y, y + self.strip_rows)
+
+    def _bincount(self, index_fn, minlength: int) -> np.ndarray:
+        # Strip-wise so the intp temporaries of np.bincount stay small on big scans.
+        hist = np.zeros(minlength, np.int64)
+        for sl in self._strips():
+            hist += np.bincount(index_fn(sl).ravel(), minlength=minlength)
+        return hist
+
+    def sat_hist(self) -> np.ndarray:
+        return self._memo("sat", lambda: self._bincount(lambda sl: self.hsv[sl, :, 1], 256))
+
+    def gray_hist(self) -> np.ndarray:
+        return self._memo("grayh", lambda: self._bincount(lambda sl: self.gray[sl], 256))
+
+    def ab_hist(self) -> np.ndarray:
+        """Joint 256x256 histogram of Lab (a, b); marginals give a/b, cells give chroma."""
+        def idx(sl):
+            lab = self.lab[sl]
+            return (lab[:, :, 1].astype(np.uint16) << 8) | lab[:, :, 2]
+        return self._memo("ab", lambda: self._bincount(idx, 65536).reshape(256, 256))
+
+    def hue_hist(self, s_min: float, v_min: float, v_max: float) -> np.ndarray:
+        """Histogram of OpenCV hue over pixels with S >= s_min and v_min <= V <= v_max."""
+        s_ok = _UNIT >= s_min
+        v_ok = (_UNIT >= v_min) & (_UNIT <= v_max)
+        def hist():
+            h = np.zeros(256, np.int64)
+            for sl in self._strips():
+                hsv = self.hsv[sl]
+                sel = s_ok[hsv[:, :, 1]] & v_ok[hsv[:, :, 2]]
+                h += np.bincount(hsv[:, :, 0][sel], minlength=256)
+            return h
+        return self._memo(("hue", s_min, v_min, v_max), hist)
 
 # --------------- Metrics / classification ---------------
-def image_metrics(img_bgr: np.ndarray) -> Dict[str, float]:
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
-    mean_sat = float(np.mean(hsv[:,:,1]))/255.0
+def image_metrics(img_bgr: np.ndarray, an: ColorAnalysis = None) -> Dict[str, float]:
+    an = an or ColorAnalysis(img_bgr)
+    mean_sat = _hist_mean_std(an.sat_hist(), _U8)[0]/255.0
 
-    lab = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB).astype(np.float32)
-    L,a,b = cv2.split(lab)
-    a_mean = float(np.mean(a - 128.0))
-    b_mean = float(np.mean(b - 128.0))
-    a_std  = float(np.std(a - 128.0))
-    b_std  = float(np.std(b - 128.0))
-    chroma = float(np.mean(np.sqrt((a-128.0)**2 + (b-128.0)**2)))
+    ab = an.ab_hist()
+    a_mean, a_std = _hist_mean_std(ab.sum(axis=1), _CENTRED)
+    b_mean, b_std = _hist_mean_std(ab.sum(axis=0), _CENTRED)
+    chroma = _hist_mean_std(ab.ravel(), _CHROMA.ravel())[0]
 
-    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32)/255.0
-    contrast = float(np.std(gray))
+    contrast = _hist_mean_std(an.gray_hist(), _UNIT)[1]
 
     return dict(mean_sat=mean_sat, a_mean=a_mean, b_mean=b_mean,
                 a_std=a_std, b_std=b_std, chroma=chroma, contrast=contrast)
@@ -83,64 +157,35 @@ def classify_initial(m: Dict[str,float],
     return 'maybe_color'
 
 # --------------- Corrections ---------------
-def levels_per_channel(img_bgr: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
-    out = img_bgr.astype(np.float32)
-    for c in range(3):
-        ch = out[:,:,c]
-        lo = float(np.quantile(ch, low_q)); hi = float(np.quantile(ch, high_q))
-        if hi <= lo + 1e-6: continue
-        out[:,:,c] = np.clip((ch - lo) * (255.0/(hi - lo)), 0, 255)
-    return out.astype(np.uint8)
-
-def gray_world_wb(img_bgr: np.ndarray) -> np.ndarray:
-    b,g,r = cv2.split(img_bgr.astype(np.float32))
-    mb, mg, mr = [np.mean(x) + 1e-6 for x in (b,g,r)]
-    avg = (mb + mg + mr) / 3.0
-    b *= (avg/mb); g *= (avg/mg); r *= (avg/mr)
-    return np.clip(cv2.merge((b,g,r)),0,255).astype(np.uint8)
-
-def clahe_gray(img_gray: np.ndarray) -> np.ndarray:
-    clahe = cv2.createCLAHE(clipLimit=2.2, tileGridSize=(8,8))
-    return clahe.apply(img_gray)
-
-def de_yellow_lab(img_bgr: np.ndarray, strength=1.0) -> np.ndarray:
-    lab = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB).astype(np.float32)
-    L,a,b = cv2.split(lab)
-    shift = np.mean(b - 128.0) * strength
-    b = b - shift
-    out = cv2.cvtColor(np.clip(cv2.merge((L,a,b)),0,255).astype(np.uint8), cv2.COLOR_LAB2BGR)
-    return out
-
-def boost_saturation(img_bgr: np.ndarray, factor=1.10) -> np.ndarray:
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV).astype(np.float32)
-    h,s,v = cv2.split(hsv); s = np.clip(s * factor, 0, 255)
-    return cv2.cvtColor(np.uint8(cv2.merge((h,s,v))), cv2.COLOR_HSV2BGR)
-
-def to_grayscale_bgr(img_bgr: np.ndarray) -> np.ndarray:
-    g = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-    g = clahe_gray(g)
-    return cv2.cvtColor(g, cv2.COLOR_GRAY2BGR)
+# The branches as stage chains (see correct_pipeline.py), so a multi-variant run
+# shares e.g. the white balance with `_ac` and gray+CLAHE with `_bw`.
+BW_CHAIN = [GRAY, clahe(2.2, (8,8)), GRAY_BGR]
+
+def color_chain(low_q=0.01, high_q=0.99) -> List[Stage]:
+    return [WB, de_yellow(1.0), saturation(1.10), levels(low_q, high_q)]
+
+def chains(args) -> List[List[Stage]]:
+    """Every stage chain render() may run (lets auto_correct_multi.py plan shared prefixes)."""
+    return [color_chain(args.low_q, args.high_q), BW_CHAIN]
+
+def to_grayscale_bgr(img_bgr: np.ndarray, an: ColorAnalysis = None) -> np.ndarray:
+    g = an.gray if an is not None else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    return gray_to_bgr(apply_clahe(g, 2.2, (8,8)))
 
 def color_pipeline(img_bgr: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
-    out = gray_world_wb(img_bgr)
-    out = de_yellow_lab(out, 1.0)
-    out = boost_saturation(out, 1.10)
-    out = levels_per_channel(out, low_q, high_q)
-    return out
+    return run_chain(img_bgr, color_chain(low_q, high_q))
 
 # ---------- Hue dispersion stats (anti-sepia) ----------
-def hue_dispersion_stats(img_bgr: np.ndarray, s_min=0.20, v_min=0.12, v_max=0.98, bins=36, bin_frac=0.02):
+def hue_dispersion_stats(img_bgr: np.ndarray, s_min=0.20, v_min=0.12, v_max=0.98, bins=36, bin_frac=0.02,
+                         an: ColorAnalysis = None):
     """Return how spread the hues are among reasonably saturated & valid pixels."""
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV).astype(np.float32)
-    H = hsv[:,:,0]  # 0..180 in OpenCV
-    S = hsv[:,:,1] / 255.0
-    V = hsv[:,:,2] / 255.0
-    mask = (S >= s_min) & (V >= v_min) & (V <= v_max)
-    if np.count_nonzero(mask) < 50:
+    an = an or ColorAnalysis(img_bgr)
+    counts = an.hue_hist(s_min, v_min, v_max)  # H is 0..180 in OpenCV
+    if counts.sum() < 50:
         return dict(num_sig_bins=0, max_bin_frac=0.0, frac_yellow=0.0, total=0)
-    H_sel = H[mask].flatten()
-    # Histogram on 0..180 with `bins`
-    hist, edges = np.histogram(H_sel, bins=bins, range=(0,180))
+    # Histogram on 0..180 with `bins`; re-binning the per-value counts gives the
+    # same bins as histogramming the selected pixels directly
+    hist, edges = np.histogram(np.arange(256), bins=bins, range=(0,180), weights=counts)
     total = int(hist.sum())
     if total == 0:
         return dict(num_sig_bins=0, max_bin_frac=0.0, frac_yellow=0.0, total=0)
@@ -157,18 +202,16 @@ def hue_dispersion_stats(img_bgr: np.ndarray, s_min=0.20, v_min=0.12, v_max=0.98
     return dict(num_sig_bins=num_sig_bins, max_bin_frac=max_bin_frac, frac_yellow=frac_yellow, total=total)
 
 # ---------- Post-color decision: keep or fall back to B&W ----------
-def color_stats(img_bgr: np.ndarray) -> Dict[str,float]:
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV).astype(np.float32)
-    S = hsv[:,:,1] / 255.0
-    S_mean = float(np.mean(S))
-    S_p95  = float(np.quantile(S, 0.95))
-    S_frac_hi = float(np.mean(S > 0.25))
-
-    lab = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB).astype(np.float32)
-    L,a,b = cv2.split(lab)
-    C = np.sqrt((a-128.0)**2 + (b-128.0)**2)
-    C_mean = float(np.mean(C))
-    C_p90  = float(np.quantile(C, 0.90))
+def color_stats(img_bgr: np.ndarray, an: ColorAnalysis = None) -> Dict[str,float]:
+    an = an or ColorAnalysis(img_bgr)
+    sh = an.sat_hist()
+    S_mean = _hist_mean_std(sh, _UNIT)[0]
+    S_p95  = hist_quantile(sh, _UNIT, 0.95)
+    S_frac_hi = float(sh[_UNIT > 0.25].sum()) / float(sh.sum())
+
+    ab = an.ab_hist().ravel()
+    C_mean = _hist_mean_std(ab, _CHROMA.ravel())[0]
+    C_p90  = hist_quantile(ab, _CHROMA.ravel(), 0.90)
     return dict(S_mean=S_mean, S_p95=S_p95, S_frac_hi=S_frac_hi, C_mean=C_mean, C_p90=C_p90)
 
 def should_keep_color(stats: Dict[str,float], hue: Dict[str,float], initial_b_mean: float, args) -> bool:
@@ -193,59 +236,223 @@ def should_keep_color(stats: Dict[str,float], hue: Dict[str,float], initial_b_me
     return bins_ok and yellow_ok
 
 # --------------- Pipeline ---------------
-def process_one(path: str, out_path: str, args, log_fh):
-    img = imread_color(path)
-    if args.max_edge > 0: img = resize_max_edge(img, args.max_edge)
-
-    # initial metrics & class
-    m0 = image_metrics(img)
+def make_proxy(img: np.ndarray, proxy_edge: int) -> np.ndarray:
+    """Reduced copy for classification: halve with pyrDown, then INTER_AREA to proxy_edge."""
+    while max(img.shape[:2]) >= 4 * proxy_edge:
+        img = cv2.pyrDown(img)
+    return resize_max_edge(img, proxy_edge)
+
+def classify(img: np.ndarray, args, an0: ColorAnalysis = None, cache: StageCache = None) -> Dict:
+    """Initial class + trial colour pipeline + anti-sepia gate on `img`.
+
+    Returns the decision and its metrics; `cand` is the colour candidate at the
+    resolution of `img` (None when the initial class is already B&W). `cache`, if
+    given, is a StageCache over `img` the colour chain runs through.
+    """
+    an0 = an0 or ColorAnalysis(img)
+    m0 = image_metrics(img, an0)
     if args.force_bw: label = 'bw_neutral'
     elif args.force_color: label = 'maybe_color'
     else: label = classify_initial(m0, args.sat_bw, args.chroma_bw, args.yellow_b)
 
     if label.startswith('bw'):
-        fixed = to_grayscale_bgr(img)
-        final_label = label
-        kept_color = False
-        stats = {}; hue = {}
+        return dict(label=label, final_label=label, kept_color=False, initial=m0, stats={}, hue={}, cand=None)
+
+    chain = color_chain(args.low_q, args.high_q)
+    cand = cache.run(chain) if cache is not None else run_chain(img, chain)
+    an = ColorAnalysis(cand)
+    stats = color_stats(cand, an)
+    hue = hue_dispersion_stats(cand, s_min=args.hue_s_min, v_min=0.12, v_max=0.98,
+                               bins=args.hue_bins, bin_frac=args.hue_bin_frac, an=an)
+    kept = should_keep_color(stats, hue, m0['b_mean'], args)
+    return dict(label=label, final_label='color_faded' if kept else 'bw_from_color_fallback',
+                kept_color=kept, initial=m0, stats=stats, hue=hue, cand=cand)
+
+def outputs(out_path: str, args, rec: Dict = None) -> List[str]:
+    """Files written for `out_path`: the record's list once rendered (--save-both depends on the image),
+    else the ones every render writes."""
+    if rec and "outputs" in rec:
+        return rec["outputs"]
+    return [out_path] + ([os.path.splitext(out_path)[0] + "_preview.jpg"] if args.preview else [])
+
+def render(cache: StageCache, path: str, out_path: str, args) -> Dict:
+    """Correct the decoded image in `cache`, write the outputs and return the log record."""
+    img = cache.img
+    # Decide on a proxy when asked; then render only the winning branch at full res.
+    if args.proxy_edge > 0:
+        d = classify(make_proxy(img, args.proxy_edge), args)
+        full_cand = lambda: cache.run(color_chain(args.low_q, args.high_q))
     else:
-        cand = color_pipeline(img, args.low_q, args.high_q)
-        stats = color_stats(cand)
-        hue = hue_dispersion_stats(cand, s_min=args.hue_s_min, v_min=0.12, v_max=0.98,
-                                   bins=args.hue_bins, bin_frac=args.hue_bin_frac)
-        if should_keep_color(stats, hue, m0['b_mean'], args):
-            fixed = cand; final_label = 'color_faded'; kept_color = True
-        else:
-            fixed = to_grayscale_bgr(img); final_label = 'bw_from_color_fallback'; kept_color = False
-
-        if args.save_both:
-            base, ext = os.path.splitext(out_path)
-            ext_out = (args.format.lower() if args.format else ext[1:].lower())
-            params = []
-            if ext_out in ('jpg','jpeg'): params=[int(cv2.IMWRITE_JPEG_QUALITY), int(args.quality)]
-            elif ext_out=='png': params=[int(cv2.IMWRITE_PNG_COMPRESSION), 3]
-            ensure_dir(os.path.dirname(out_path))
-            cv2.imwrite(base + "_color." + ext_out, cand, params)
-            cv2.imwrite(base + "_bw." + ext_out, to_grayscale_bgr(img), params)
+        d = classify(img, args, cache=cache)
+        full_cand = lambda: d['cand']
+    final_label, kept_color = d['final_label'], d['kept_color']
+    m0, stats, hue = d['initial'], d['stats'], d['hue']
+
+    cand = full_cand() if kept_color or (args.save_both and d['cand'] is not None) else None
+    fixed = cand if kept_color else cache.run(BW_CHAIN)
+
+    params = imwrite_params(out_path, args.quality, args.format)
+    ensure_dir(os.path.dirname(out_path))
+    written = outputs(out_path, args)
+    if args.save_both and cand is not None:
+        base, ext = os.path.splitext(out_path)
+        cv2.imwrite(base + "_color" + ext, cand, params)
+        cv2.imwrite(base + "_bw" + ext, cache.run(BW_CHAIN), params)
+        written += [base + "_color" + ext, base + "_bw" + ext]
 
     # write output
-    ext_out = args.format.lower() if args.format else os.path.splitext(out_path)[1][1:].lower()
-    params = []
-    if ext_out in ('jpg','jpeg'): params=[int(cv2.IMWRITE_JPEG_QUALITY), int(args.quality)]
-    elif ext_out=='png': params=[int(cv2.IMWRITE_PNG_COMPRESSION), 3]
-    ensure_dir(os.path.dirname(out_path)); cv2.imwrite(out_path, fixed, params)
+    cv2.imwrite(out_path, fixed, params)
 
     # preview
     if args.preview:
         combo = side_by_side(img, fixed, max_h=800)
-        pre_path = os.path.splitext(out_path)[0] + "_preview.jpg"
+        pre_path = written[1]
         cv2.imwrite(pre_path, combo, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
 
-    # log
-    log_fh.write(json.dumps({
-        "file": path, "out": out_path, "class": final_label,
-        "initial": m0, "keep_color_stats": stats, "hue_dispersion": hue, "kept_color": kept_color
-    }) + "\n")
+    return {
+        "file": path, "out": out_path, "outputs": written, "class": final_label,
+        "initial": m0, "keep_color_stats": stats, "hue_dispersion": hue, "kept_color": kept_color,
+        **({"proxy_edge": args.proxy_edge} if args.proxy_edge > 0 else {})
+    }
+
+def process_one(path: str, out_path: str, args) -> Dict:
+    """Correct one file and return its log record (runs inside a pool worker with --jobs)."""
+    img = resize_max_edge(imread_color(path), args.max_edge)
+    return render(StageCache(img, chains(args)), path, out_path, args)
+
+def proxy_report_one(path: str, args) -> Dict:
+    """Classify one file at full res and on the proxy; nothing is written."""
+    img = resize_max_edge(imread_color(path), args.max_edge)
+    t0 = time.perf_counter(); full = classify(img, args)
+    t1 = time.perf_counter(); proxy = classify(make_proxy(img, args.proxy_edge), args)
+    t2 = time.perf_counter()
+    return {"file": path, "full": full['final_label'], "proxy": proxy['final_label'],
+            "full_ms": round((t1 - t0) * 1000, 1), "proxy_ms": round((t2 - t1) * 1000, 1)}
+
+def proxy_report(files: List[str], out_root: str, args):
+    """Print how often the proxy decision differs from the full-res one over `files`."""
+    report_path = os.path.join(out_root, "proxy_report.jsonl")
+    pairs: Dict[Tuple[str, str], int] = {}
+    n = diff = 0; full_ms = proxy_ms = 0.0
+    with open(report_path, "w") as fh:
+        for idx, ((src, _), rec, err) in enumerate(run_tasks(proxy_report_one, [(f, args) for f in files], args.jobs), 1):
+            if err:
+                print(f"[{idx}/{len(files)}] {src}\n  ! Error: {err.splitlines()[0]}"); continue
+            n += 1; full_ms += rec['full_ms']; proxy_ms += rec['proxy_ms']
+            key = (rec['full'], rec['proxy']); pairs[key] = pairs.get(key, 0) + 1
+            if rec['full'] != rec['proxy']:
+                diff += 1
+                print(f"[{idx}/{len(files)}] DIFF {src}: full={rec['full']} proxy={rec['proxy']}")
+            fh.write(json.dumps(rec) + "\n")
+    if not n: print("No images classified."); return
+    print(f"\nProxy edge {args.proxy_edge}px: {diff}/{n} decisions differ ({100.0*diff/n:.1f}%)")
+    for (f, p), c in sorted(pairs.items()):
+        print(f"  full={f:<24} proxy={p:<24} {c}")
+    print(f"Classification time per image: full {full_ms/n:.0f} ms, proxy {proxy_ms/n:.0f} ms")
+    print(f"Report: {report_path}")
+
+# --------------- Metrics store / reclassify ---------------
+# Everything should_keep_color/classify_initial look at, one column per number, so
+# a threshold sweep is a few vectorised comparisons instead of a full rerun.
+STORE_NAME = "auto_correct_smart.metrics.npz"
+INITIAL_KEYS = ("mean_sat", "a_mean", "b_mean", "a_std", "b_std", "chroma", "contrast")
+STATS_KEYS = ("S_mean", "S_p95", "S_frac_hi", "C_mean", "C_p90")
+HUE_KEYS = ("num_sig_bins", "max_bin_frac", "frac_yellow", "total")
+# Options that change the measured numbers themselves; --reclassify cannot vary these.
+MEASURE_KEYS = ("max_edge", "proxy_edge", "low_q", "high_q", "hue_s_min", "hue_bins", "hue_bin_frac")
+NOT_STORED = ("proxy_report", "reclassify", "dry_run")
+
+def write_metrics_store(path: str, records: List[Dict], params: Dict):
+    recs = [r for r in records if "error" not in r]
+    cols = {
+        "src": np.array([os.path.abspath(r["file"]) for r in recs], dtype=str),
+        "out": np.array([r["out"] for r in recs], dtype=str),
+        "class": np.array([r["class"] for r in recs], dtype=str),
+        "params": np.array(json.dumps(params, default=str)),
+    }
+    for prefix, field, keys in (("m0_", "initial", INITIAL_KEYS), ("st_", "keep_color_stats", STATS_KEYS),
+                                ("hue_", "hue_dispersion", HUE_KEYS)):
+        for k in keys:
+            cols[prefix + k] = np.array([r[field].get(k, np.nan) for r in recs], dtype=np.float64)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **cols)
+    os.replace(tmp, path)
+
+def load_metrics_store(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+def reclassify_columns(cols: Dict[str, np.ndarray], args) -> np.ndarray:
+    """Vectorised classify_initial + should_keep_color over the whole store.
+
+    Files that would now need the colour pipeline but were never measured with it
+    (initially B&W last time) come back as 'unmeasured'.
+    """
+    m = lambda k: cols["m0_" + k]; st = lambda k: cols["st_" + k]; hu = lambda k: cols["hue_" + k]
+    n = len(cols["src"])
+    if args.force_bw: bw = np.ones(n, bool)
+    elif args.force_color: bw = np.zeros(n, bool)
+    else: bw = (m("mean_sat") < args.sat_bw) & (m("chroma") < args.chroma_bw) & (m("a_std") < 4.0) & (m("b_std") < 4.0)
+    initial = np.where(m("b_mean") > args.yellow_b, "bw_yellowed", "bw_neutral")
+    if args.force_bw: initial[:] = "bw_neutral"
+
+    global_ok = ((st("S_mean") >= args.keep_color_sat_mean) & (st("S_p95") >= args.keep_color_sat_p95) &
+                 (st("S_frac_hi") >= args.keep_color_frac) & (st("C_mean") >= args.keep_color_chroma_mean) &
+                 (st("C_p90") >= args.keep_color_chroma_p90))
+    sepia = m("b_mean") >= args.b_sepia_cut
+    bins_ok = (hu("num_sig_bins") >= args.min_hue_bins) & (hu("max_bin_frac") <= args.max_dominant_bin)
+    bins_ok &= ~sepia | (hu("max_bin_frac") <= min(args.max_dominant_bin, 0.45))
+    yellow_ok = np.where(sepia, hu("frac_yellow") <= args.max_yellow_frac * 0.6, hu("frac_yellow") <= args.max_yellow_frac)
+    kept = global_ok & bins_ok & yellow_ok
+
+    out = np.where(kept, "color_faded", "bw_from_color_fallback").astype(object)
+    out[np.isnan(st("S_mean"))] = "unmeasured"
+    out[bw] = initial[bw]
+    return out.astype(str)
+
+def reclassify(out_root: str, args):
+    """Re-evaluate the thresholds over the stored metrics; re-render only flipped files."""
+    t0 = time.perf_counter()
+    cols = load_metrics_store(os.path.join(out_root, STORE_NAME))
+    old, new = cols["class"], reclassify_columns(cols, args)
+    changed = np.flatnonzero(old != new)
+    is_color = lambda a: a == "color_faded"
+    print(f"Reclassified {len(old)} file(s) in {(time.perf_counter() - t0)*1000:.1f} ms")
+    print(f"  B&W -> colour: {int(np.sum(~is_color(old) & is_color(new)))}")
+    print(f"  colour -> B&W: {int(np.sum(is_color(old) & ~is_color(new) & (new != 'unmeasured')))}")
+    print(f"  unmeasured (need the colour pipeline): {int(np.sum(new == 'unmeasured'))}")
+    flips: Dict[Tuple[str, str], int] = {}
+    for i in changed:
+        flips[(old[i], new[i])] = flips.get((old[i], new[i]), 0) + 1
+    for (a, b), c in sorted(flips.items()):
+        print(f"    {a:<24} -> {b:<24} {c}")
+    if args.dry_run:
+        return
+
+    # Re-render just the changed files, then bring log, store and manifest up to date.
+    log_path = os.path.join(out_root, "auto_correct_smart.log.jsonl")
+    with open(log_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    params = effective_params(args, ignore=NOT_STORED)
+    manifest = SkipManifest(out_root, "auto_correct_smart", params)
+    redo = {cols["src"][i]: cols["out"][i] for i in changed}
+    tasks = [(src, out, args) for src, out in redo.items()]
+    updated = {}
+    for idx, ((src, out, _), rec, err) in enumerate(run_tasks(process_one, tasks, args.jobs), 1):
+        print(f"[{idx}/{len(tasks)}] {src} -> {out}")
+        if err:
+            print(f"  ! Error: {err.splitlines()[0]}"); continue
+        updated[src] = rec
+        manifest.record(src, outputs(out, args, rec), rec)
+    records = [updated.get(os.path.abspath(r["file"]), r) for r in records]
+    for r in records:
+        if "error" not in r and os.path.abspath(r["file"]) not in redo:
+            manifest.rekey(r["file"], outputs(r["out"], args, r))
+    manifest.save()
+    with open(log_path, "w") as f:
+        for r in records: f.write(json.dumps(r) + "\n")
+    write_metrics_store(os.path.join(out_root, STORE_NAME), records, params)
 
 def side_by_side(a: np.ndarray, b: np.ndarray, max_h=800) -> np.ndarray:
     def resize_h(x, h):
@@ -255,14 +462,20 @@ def side_by_side(a: np.ndarray, b: np.ndarray, max_h=800) -> np.ndarray:
     pad = np.ones((max_h, 16, 3), np.uint8) * 255
     return np.hstack([a2, pad, b2])
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Heuristic auto-correct for mixed B&W/Color album photos with anti-sepia gating.")
-    ap.add_argument("--input", required=True); ap.add_argument("--out", required=True)
+    ap.add_argument("--input"); ap.add_argument("--out", required=True)
     ap.add_argument("--recursive", action="store_true"); ap.add_argument("--inplace", action="store_true")
     ap.add_argument("--extensions", default="jpg,jpeg,png,tif,tiff,bmp")
     ap.add_argument("--suffix", default="_fixed"); ap.add_argument("--format", default="")
     ap.add_argument("--quality", type=int, default=92); ap.add_argument("--preview", action="store_true")
     ap.add_argument("--max-edge", type=int, default=0)
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = all cores, 1 = serial)")
+    ap.add_argument("--proxy-edge", type=int, default=0,
+                    help="Classify on a proxy with this longest edge; only the chosen branch is rendered at full res (0=off)")
+    ap.add_argument("--proxy-report", action="store_true",
+                    help="Write nothing; report how often the --proxy-edge decision differs from the full-res one")
+    ap.add_argument("--force", action="store_true", help="Reprocess every file, ignoring the skip manifest in the output root")
 
     # initial classification thresholds (conservative)
     ap.add_argument("--sat-bw", type=float, default=0.16)
@@ -294,7 +507,34 @@ def main():
     ap.add_argument("--force-color", action="store_true")
     ap.add_argument("--save-both", action="store_true")
 
+    # threshold sweeps over the metrics store of a previous run in --out
+    ap.add_argument("--reclassify", action="store_true",
+                    help="Re-apply the thresholds to the stored metrics in --out; re-render only files whose decision flips")
+    ap.add_argument("--dry-run", action="store_true", help="With --reclassify: only print the flip counts")
+    return ap
+
+def main():
+    ap = build_parser()
+
+    pre, _ = ap.parse_known_args()
+    if pre.reclassify:
+        # Options not given now default to those of the run that built the store
+        store_path = os.path.join(os.path.abspath(pre.out), STORE_NAME)
+        if not os.path.isfile(store_path):
+            ap.error(f"--reclassify: no metrics store at {store_path}")
+        stored = json.loads(str(load_metrics_store(store_path)["params"]))
+        ap.set_defaults(**stored)
     args = ap.parse_args()
+    if pre.reclassify:
+        moved = [k for k in MEASURE_KEYS if getattr(args, k) != stored.get(k)]
+        if moved:
+            ap.error("--reclassify cannot change " + ", ".join("--" + k.replace("_", "-") for k in moved)
+                     + "; rerun without --reclassify")
+        reclassify(os.path.abspath(args.out), args); return
+    if not args.input:
+        ap.error("--input is required")
+    if args.proxy_report and args.proxy_edge <= 0:
+        ap.error("--proxy-report needs --proxy-edge")
 
     exts = [e.strip().lower() for e in args.extensions.split(",") if e.strip()]
     files = list_images(args.input, exts, args.recursive)
@@ -302,24 +542,42 @@ def main():
 
     in_root = os.path.abspath(args.input if os.path.isdir(args.input) else os.path.dirname(args.input))
     out_root = os.path.abspath(args.out); ensure_dir(out_root)
+    if args.proxy_report:
+        proxy_report(files, out_root, args); return
     log_path = os.path.join(out_root, "auto_correct_smart.log.jsonl")
 
+    tasks = [(src, out_path_for(src, args.input, in_root, out_root, args.suffix, args.format, args.inplace), args)
+             for src in files]
+
+    # Unchanged inputs keep their previous outputs and log records
+    params = effective_params(args, ignore=NOT_STORED)
+    manifest = SkipManifest(out_root, "auto_correct_smart", params, enabled=not args.force)
+    cached = [manifest.check(src, outputs(out_path, args)) for src, out_path, _ in tasks]
+    todo = [t for t, c in zip(tasks, cached) if c is None]
+    if len(todo) < len(tasks):
+        print(f"Skipping {len(tasks) - len(todo)} unchanged file(s) (use --force to redo them).")
+
+    results = run_tasks(process_one, todo, args.jobs)
+    records = []
     with open(log_path, "w") as log_fh:
-        total = len(files)
-        for idx, src in enumerate(files, 1):
-            rel = os.path.relpath(src, in_root) if os.path.isdir(args.input) else os.path.basename(src)
-            base, ext = os.path.splitext(rel)
-            if args.inplace:
-                dst_rel = rel if not args.format else base + "." + args.format.lower()
+        total = len(todo); done = 0
+        for (src, out_path, _), hit in zip(tasks, cached):
+            if hit is not None:
+                records.append(hit["record"])
+                log_fh.write(json.dumps(hit["record"]) + "\n")
+                continue
+            _, rec, err = next(results); done += 1
+            print(f"[{done}/{total}] {src} -> {out_path}")
+            if err:
+                print(f"  ! Error: {err.splitlines()[0]}")
+                rec = {"file": src, "out": out_path, "error": err.splitlines()[0]}
             else:
-                dst_rel = base + args.suffix + "." + (args.format.lower() if args.format else ext[1:].lower())
-            out_path = os.path.join(out_root, dst_rel)
-
-            print(f"[{idx}/{total}] {src} -> {out_path}")
-            try:
-                process_one(src, out_path, args, log_fh)
-            except Exception as e:
-                print(f"  ! Error: {e}")
+                manifest.record(src, outputs(out_path, args, rec), rec)
+            records.append(rec)
+            log_fh.write(json.dumps(rec) + "\n")
+            log_fh.flush()
+    manifest.save()
+    write_metrics_store(os.path.join(out_root, STORE_NAME), records, params)
 
     print(f"Done. Outputs at: {out_root}\nLog: {log_path}")
 
@@ -2,19 +2,22 @@ import os
 import time
 import re
 import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import threading
 import exifread
 import io
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
-from PIL import Image
+from PIL import Image, ImageOps
 from google.api_core import exceptions
 
 # --- CONFIGURATION ---
 API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("API_KEY")
 
-if not API_KEY:
-    raise ValueError("API_KEY not found. Please run: export API_KEY='Your_Key'")
-
 MODEL_NAME = "gemini-3-pro-image-preview"
 PROMPT = """
 Rerender this image in a high-fidelity, cinematic lighting style, keeping the original composition. 
@@ -28,8 +31,14 @@ it in the rendered image.
 VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
 # ---------------------
 
-def setup(output_folder):
-    client = genai.Client(api_key=API_KEY)
+def setup(output_folder, base_url=None):
+    if not API_KEY:
+        raise ValueError("API_KEY not found. Please run: export API_KEY='Your_Key'")
+    if base_url:
+        # e.g. a local stub server for testing the batch logic without quota
+        client = genai.Client(api_key=API_KEY, http_options=types.HttpOptions(base_url=base_url))
+    else:
+        client = genai.Client(api_key=API_KEY)
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     return client
@@ -42,6 +51,47 @@ def extract_wait_time(error_message):
     return 60.0 # Default to 60s if parse fails
 
 
+def error_code(e):
+    """HTTP status of an API error (google.genai errors carry .code, api_core ones .code())."""
+    code = getattr(e, "code", None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            return None
+    code = getattr(code, "value", code)
+    return code if isinstance(code, int) else None
+
+
+def is_rate_limit(e):
+    """429 from either client library."""
+    return isinstance(e, exceptions.ResourceExhausted) or error_code(e) == 429
+
+
+def is_transient(e):
+    """Timeouts and 5xx: worth a short wait and another attempt."""
+    if isinstance(e, (exceptions.DeadlineExceeded, exceptions.ServiceUnavailable, asyncio.TimeoutError)):
+        return True
+    code = error_code(e)
+    return code is not None and code >= 500
+
+
+def plan_output(filename, output_folder, index=None):
+    """Output path for `filename` (`_c`, or `_c2` when `_c` carries a blue label/keyword); None if done."""
+    name, ext = os.path.splitext(filename)
+    output_path = os.path.join(output_folder, f"{name}_c{ext}")
+    try:
+        st = os.stat(output_path)
+    except FileNotFoundError:
+        return output_path
+    if not has_blue_label_or_keyword(output_path, index, st):
+        return None
+    output_path = os.path.join(output_folder, f"{name}_c2{ext}")
+    if os.path.exists(output_path):
+        return None
+    return output_path
+
+
 def extract_xmp_text(image_path):
     try:
         with open(image_path, 'rb') as f:
@@ -56,50 +106,178 @@ def extract_xmp_text(image_path):
     return None
 
 
-def get_image_label(image_path):
+def label_from_xmp(xmp_text):
+    match = re.search(r'xmp:Label="([^"]+)"', xmp_text)
+    if match:
+        return match.group(1)
+    match = re.search(r'photoshop:LabelColor="([^"]+)"', xmp_text)
+    if match:
+        return match.group(1)
+    return None
+
+
+def keywords_from_xmp(xmp_text):
+    subject_match = re.search(r"<dc:subject>(.*?)</dc:subject>", xmp_text, re.DOTALL)
+    if not subject_match:
+        return []
+    subject_block = subject_match.group(1)
+    return re.findall(r"<rdf:li>([^<]+)</rdf:li>", subject_block)
+
+
+def exif_label(f):
     try:
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False)
+        tags = exifread.process_file(f, details=False)
         label = tags.get('Image Label')
         if label:
             return str(label)
     except Exception:
         pass
+    return None
+
+
+def get_image_label(image_path):
+    try:
+        with open(image_path, 'rb') as f:
+            label = exif_label(f)
+    except OSError:
+        label = None
+    if label:
+        return label
 
     xmp_text = extract_xmp_text(image_path)
     if not xmp_text:
         return None
-
-    match = re.search(r'xmp:Label="([^"]+)"', xmp_text)
-    if match:
-        return match.group(1)
-    match = re.search(r'photoshop:LabelColor="([^"]+)"', xmp_text)
-    if match:
-        return match.group(1)
-    return None
+    return label_from_xmp(xmp_text)
 
 
 def get_image_keywords(image_path):
     xmp_text = extract_xmp_text(image_path)
     if not xmp_text:
         return []
-    subject_match = re.search(r"<dc:subject>(.*?)</dc:subject>", xmp_text, re.DOTALL)
-    if not subject_match:
-        return []
-    subject_block = subject_match.group(1)
-    return re.findall(r"<rdf:li>([^<]+)</rdf:li>", subject_block)
+    return keywords_from_xmp(xmp_text)
+
+
+# --- JPEG HEADER SCAN ---
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+EXIF_HEADER = b"Exif\x00\x00"
+SOS, EOI, APP1 = 0xDA, 0xD9, 0xE1
+
+
+def read_jpeg_app1(image_path):
+    """(exif_tiff_bytes, xmp_text) from a JPEG's APP1 segments, or None if not a JPEG.
+
+    Walks the marker segments and stops at SOS, so only the header is read,
+    never the entropy-coded image data.
+    """
+    exif = xmp = None
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                break
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":  # fill bytes
+                marker = f.read(1)
+            if not marker:
+                break
+            m = marker[0]
+            if m in (SOS, EOI):
+                break
+            if m == 0x01 or 0xD0 <= m <= 0xD7:  # no length field
+                continue
+            size = f.read(2)
+            if len(size) < 2:
+                break
+            length = int.from_bytes(size, "big") - 2
+            if m != APP1 or length <= 0:
+                f.seek(length, 1)
+                continue
+            payload = f.read(length)
+            if payload.startswith(EXIF_HEADER) and exif is None:
+                exif = payload[len(EXIF_HEADER):]
+            elif payload.startswith(XMP_HEADER) and xmp is None:
+                xmp = payload[len(XMP_HEADER):].decode("utf-8", errors="replace")
+    return exif, xmp
 
 
-def has_blue_label_or_keyword(image_path):
-    label = get_image_label(image_path)
+def read_label_info(image_path):
+    """(label, keywords) of an image; header-only for JPEG, full scan for other formats."""
+    try:
+        segments = read_jpeg_app1(image_path)
+    except OSError:
+        return None, []
+    if segments is None:
+        return get_image_label(image_path), get_image_keywords(image_path)
+    exif, xmp = segments
+    label = exif_label(io.BytesIO(exif)) if exif else None
+    if not label and xmp:
+        label = label_from_xmp(xmp)
+    return label, keywords_from_xmp(xmp) if xmp else []
+
+
+class LabelIndex:
+    """Sidecar cache of (label, keywords) per output file, keyed by size+mtime.
+
+    Stored as <output>/.label_index.json, so a resumed run stats each finished
+    output instead of reading its metadata again.
+    """
+
+    NAME = ".label_index.json"
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, self.NAME)
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def lookup(self, image_path, st=None):
+        st = st or os.stat(image_path)
+        key = os.path.basename(image_path)
+        e = self.entries.get(key)
+        if e and e["size"] == st.st_size and e["mtime_ns"] == st.st_mtime_ns:
+            return e["label"], e["keywords"]
+        label, keywords = read_label_info(image_path)
+        self.entries[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                             "label": label, "keywords": keywords}
+        self.dirty = True
+        return label, keywords
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def has_blue_label_or_keyword(image_path, index=None, st=None):
+    label, keywords = index.lookup(image_path, st) if index else read_label_info(image_path)
     if label and "blue" in label.lower():
         return True
-    for keyword in get_image_keywords(image_path):
+    for keyword in keywords:
         if "blue" in keyword.lower():
             return True
     return False
 
 
+def plan_outputs(files, output_folder):
+    """{filename: output path or None} for a whole folder, via the label index."""
+    index = LabelIndex(output_folder)
+    outputs = {f: plan_output(f, output_folder, index) for f in files}
+    index.save()
+    return outputs
+
+
 def extract_inline_image_bytes(response):
     for candidate in getattr(response, "candidates", []) or []:
         content = getattr(candidate, "content", None)
@@ -111,23 +289,139 @@ def extract_inline_image_bytes(response):
     return None
 
 
-def build_image_part(img):
-    if hasattr(types.Part, "from_image"):
-        return types.Part.from_image(
-            image=img,
-            config=types.MediaResolution(
-                level=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_ULTRA_HIGH
-            ),
-        )
+# --- UPLOAD PAYLOADS ---
+# Each image is encoded at most once: retries reuse the bytes, a background
+# thread prepares the next image while the current request is in flight, and
+# re-encoded payloads are kept in <output>/.payload_cache for the next run.
+
+PAYLOAD_CACHE_DIR = ".payload_cache"
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+EXIF_ORIENTATION = 0x0112
+
+
+def upload_as_is(img, max_edge=0):
+    """MIME type if the file behind `img` can be uploaded unchanged, else None."""
+    image_format = (img.format or "").upper()
+    fits = max_edge <= 0 or max(img.size) <= max_edge
+    upright = img.getexif().get(EXIF_ORIENTATION, 1) == 1
+    return MIME_TYPES.get(image_format) if fits and upright else None
+
+
+def encode_payload(input_path, max_edge=0, quality=92):
+    """(bytes, mime_type, reencoded) to upload for input_path.
+
+    The file goes as-is when it is already small enough, upright and in a format
+    the API takes; otherwise it is turned upright, downscaled to max_edge and re-encoded.
+    """
+    with Image.open(input_path) as img:
+        mime_type = upload_as_is(img, max_edge)
+        if mime_type:
+            with open(input_path, 'rb') as f:
+                return f.read(), mime_type, False
+
+        image_format = (img.format or "JPEG").upper()
+        if image_format not in MIME_TYPES:
+            image_format = "JPEG"
+        img.load()
+        img = ImageOps.exif_transpose(img)  # the re-encode drops EXIF, so bake the orientation in
+        if max_edge > 0 and max(img.size) > max_edge:
+            scale = max_edge / float(max(img.size))
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+        if image_format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        options = {"quality": quality} if image_format in ("JPEG", "WEBP") else {}
+        img.save(buffer, format=image_format, **options)
+        return buffer.getvalue(), MIME_TYPES[image_format], True
+
+
+def payload_key(input_path, max_edge, quality):
+    st = os.stat(input_path)
+    blob = f"{os.path.abspath(input_path)}|{st.st_size}|{st.st_mtime_ns}|{max_edge}|{quality}"
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def _cache_lookup(cache_dir, key):
+    for image_format, mime_type in MIME_TYPES.items():
+        cached = os.path.join(cache_dir, f"{key}.{image_format.lower()}")
+        if os.path.exists(cached):
+            return cached, mime_type
+    return None
+
 
-    buffer = io.BytesIO()
-    image_format = (img.format or "JPEG").upper()
-    if image_format not in ("JPEG", "PNG", "WEBP"):
-        image_format = "JPEG"
-    img.save(buffer, format=image_format)
-    mime_type = "image/jpeg" if image_format == "JPEG" else f"image/{image_format.lower()}"
+def _cache_store(cache_dir, key, data, mime_type):
+    os.makedirs(cache_dir, exist_ok=True)
+    cached = os.path.join(cache_dir, f"{key}.{mime_type.split('/')[1]}")
+    tmp = cached + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, cached)
+    return cached
+
+
+def load_payload(input_path, max_edge=0, quality=92, cache_dir=None):
+    """(bytes, mime_type) for input_path, from cache_dir when this exact encode was done before."""
+    if cache_dir:
+        key = payload_key(input_path, max_edge, quality)
+        hit = _cache_lookup(cache_dir, key)
+        if hit:
+            with open(hit[0], 'rb') as f:
+                return f.read(), hit[1]
+    data, mime_type, reencoded = encode_payload(input_path, max_edge, quality)
+    if cache_dir and reencoded:
+        _cache_store(cache_dir, key, data, mime_type)
+    return data, mime_type
+
+
+def payload_file(input_path, max_edge, quality, cache_dir=None):
+    """(source, mime_type) of the upload bytes: the input's path, its cached re-encode's path or,
+    without a cache_dir, the re-encoded bytes themselves."""
+    if cache_dir:
+        key = payload_key(input_path, max_edge, quality)
+        hit = _cache_lookup(cache_dir, key)
+        if hit:
+            return hit
+    with Image.open(input_path) as img:
+        mime_type = upload_as_is(img, max_edge)
+    if mime_type:
+        return input_path, mime_type
+    data, mime_type, _ = encode_payload(input_path, max_edge, quality)
+    if not cache_dir:
+        return data, mime_type
+    return _cache_store(cache_dir, key, data, mime_type), mime_type
+
+
+class PayloadPrefetcher:
+    """Builds payloads for `paths` on one background thread, `depth` images ahead of get()."""
+
+    def __init__(self, paths, build, depth=1):
+        self.paths = list(paths)
+        self.index = {p: i for i, p in enumerate(self.paths)}
+        self.build = build
+        self.depth = depth
+        self._next = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, path):
+        """Payload for `path` (blocks until built); later paths are queued behind it."""
+        with self._lock:
+            last = min(self.index[path] + self.depth, len(self.paths) - 1)
+            while self._next <= last:
+                p = self.paths[self._next]
+                self._futures[p] = self._pool.submit(self.build, p)
+                self._next += 1
+            future = self._futures.pop(path, None) or self._pool.submit(self.build, path)
+        return future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def build_image_part(data, mime_type):
     return types.Part.from_bytes(
-        data=buffer.getvalue(),
+        data=data,
         mime_type=mime_type,
         media_resolution=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_ULTRA_HIGH,
     )
@@ -151,8 +445,14 @@ def generate_content(client, model, contents, config):
         raise
 
 
-def process_images(input_folder, output_folder):
-    client = setup(output_folder)
+def make_prefetcher(input_folder, output_folder, filenames, max_edge, quality, use_cache, depth):
+    cache_dir = os.path.join(output_folder, PAYLOAD_CACHE_DIR) if use_cache else None
+    build = lambda path: load_payload(path, max_edge, quality, cache_dir)
+    return PayloadPrefetcher([os.path.join(input_folder, f) for f in filenames], build, depth)
+
+
+def process_images(input_folder, output_folder, base_url=None, max_edge=0, quality=92, use_cache=True):
+    client = setup(output_folder, base_url)
     
     if not os.path.exists(input_folder):
         print(f"Error: Input folder '{input_folder}' does not exist.")
@@ -165,34 +465,30 @@ def process_images(input_folder, output_folder):
     print(f"--- Starting Batch Process using {MODEL_NAME} ---")
     print(f"Found {total} images.")
 
+    outputs = plan_outputs(files, output_folder)
+    # Encodes the next image on a background thread while this one is uploading
+    prefetch = make_prefetcher(input_folder, output_folder, [f for f in files if outputs[f]],
+                               max_edge, quality, use_cache, depth=1)
+
     for index, filename in enumerate(files):
         input_path = os.path.join(input_folder, filename)
-        name, ext = os.path.splitext(filename)
-        output_filename = f"{name}_c{ext}"
-        output_path = os.path.join(output_folder, output_filename)
-
-        if os.path.exists(output_path):
-            if has_blue_label_or_keyword(output_path):
-                output_filename = f"{name}_c2{ext}"
-                output_path = os.path.join(output_folder, output_filename)
-                if os.path.exists(output_path):
-                    continue
-            else:
-                continue
+        output_path = outputs[filename]
+        if output_path is None:
+            continue
 
         print(f"[{index+1}/{total}] Processing {filename}...")
 
         # RETRY LOOP
         retry_count = 0
         max_retries = 2  # Don't try forever on a bad image
+        payload = None
 
         while retry_count < max_retries:
             try:
-                img = Image.open(input_path)
-                
-                # --- THE FIX IS HERE ---
-                # We force a 120-second timeout. If it takes longer, we kill it and retry.
-                image_part = build_image_part(img)
+                # Encoded once; retries resend the same bytes
+                if payload is None:
+                    payload = prefetch.get(input_path)
+                image_part = build_image_part(*payload)
 
                 response = generate_content(
                     client,
@@ -216,19 +512,21 @@ def process_images(input_folder, output_folder):
                     print(f"   -> Warning: No image data returned. Retrying...")
                     retry_count += 1
             
-            except exceptions.ResourceExhausted as e:
-                # HIT RATE LIMIT (429) - Wait and continue
-                wait_time = extract_wait_time(e) + 1.0
-                print(f"   -> Hit Rate Limit (429). Sleeping {wait_time:.1f}s...")
-                time.sleep(wait_time)
-            
-            except (exceptions.DeadlineExceeded, exceptions.ServiceUnavailable) as e:
-                # TIMEOUT or SERVER ERROR - Wait briefly and retry
-                print(f"   -> Network Timeout/Glitch ({type(e).__name__}). Retrying in 5s...")
-                time.sleep(5)
-                retry_count += 1
-
             except Exception as e:
+                if is_rate_limit(e):
+                    # HIT RATE LIMIT (429) - Wait and continue
+                    wait_time = extract_wait_time(e) + 1.0
+                    print(f"   -> Hit Rate Limit (429). Sleeping {wait_time:.1f}s...")
+                    time.sleep(wait_time)
+                    continue
+
+                if is_transient(e):
+                    # TIMEOUT or SERVER ERROR - Wait briefly and retry
+                    print(f"   -> Network Timeout/Glitch ({type(e).__name__}). Retrying in 5s...")
+                    time.sleep(5)
+                    retry_count += 1
+                    continue
+
                 # FATAL ERROR (Corrupt file, etc)
                 print(f"   -> FATAL ERROR on {filename}: {e}")
                 with open("error_log.txt", "a") as log:
@@ -241,10 +539,322 @@ def process_images(input_folder, output_folder):
         # Brief pause between images to be nice to the API
         time.sleep(2)
 
+    prefetch.close()
+
+# --- ASYNC MODE (--concurrency) ---
+
+class AdaptiveLimiter:
+    """Shared gate for concurrent API calls: token bucket + AIMD concurrency window.
+
+    - At most `limit` calls are in flight; `limit` grows by ~1 per window of
+      successes (additive increase) and halves on a 429 (multiplicative decrease).
+    - With `rate` > 0, calls also draw from a token bucket refilled at `rate`/s.
+    - A 429's "retry in Xs" hint pauses NEW calls until then; calls already in
+      flight are left alone, and one backoff window only halves `limit` once.
+    """
+
+    def __init__(self, max_concurrency, rate=0.0, burst=1, start=None):
+        self.max_limit = max(1, max_concurrency)
+        self.limit = float(min(self.max_limit, start or self.max_limit))
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self._stamp = time.monotonic()
+        self._cond = asyncio.Condition()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _wait_needed(self, now):
+        """Seconds until a call may start (0 = now, None = when a slot frees up)."""
+        if now < self.resume_at:
+            return self.resume_at - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate > 0 and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_needed(now)
+                if wait == 0:
+                    self.in_flight += 1
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    return
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, ok=True, retry_after=None):
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after is not None:
+                if now >= self.resume_at:
+                    self.limit = max(1.0, self.limit / 2)
+                self.resume_at = max(self.resume_at, now + retry_after)
+            elif ok:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+async def process_one_async(client, limiter, prefetch, input_path, output_path, label, timeout, max_retries=2):
+    """One image through the shared limiter; returns True when the output was saved."""
+    loop = asyncio.get_running_loop()
+    filename = os.path.basename(input_path)
+    retry_count = 0
+    payload = None
+    while retry_count < max_retries:
+        await limiter.acquire()
+        try:
+            # Fetched once a slot is ours (so only images being sent are held in
+            # memory), then reused by every retry
+            if payload is None:
+                payload = await loop.run_in_executor(None, prefetch.get, input_path)
+            image_part = build_image_part(*payload)
+            response = await asyncio.wait_for(
+                client.aio.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=[types.Part.from_text(text=PROMPT), image_part],
+                    config=types.GenerateContentConfig(response_modalities=["IMAGE"]),
+                ),
+                timeout=timeout,
+            )
+        except Exception as e:
+            if is_rate_limit(e):
+                wait_time = extract_wait_time(e) + 1.0
+                await limiter.release(ok=False, retry_after=wait_time)
+                print(f"{label} {filename}: rate limited, new calls paused {wait_time:.1f}s "
+                      f"(concurrency now {int(limiter.limit)})")
+                continue
+            await limiter.release(ok=False)
+            if is_transient(e):
+                retry_count += 1
+                print(f"{label} {filename}: timeout/glitch ({type(e).__name__}), retrying in 5s...")
+                await asyncio.sleep(5)
+                continue
+            print(f"{label} {filename}: FATAL ERROR: {e}")
+            with open("error_log.txt", "a") as log:
+                log.write(f"{filename}: {e}\n")
+            return False
+        await limiter.release(ok=True)
+
+        image_data = extract_inline_image_bytes(response)
+        if image_data:
+            await loop.run_in_executor(None, _write_bytes, output_path, image_data)
+            print(f"{label} {filename} -> Saved {os.path.basename(output_path)}")
+            return True
+        print(f"{label} {filename}: no image data returned, retrying...")
+        retry_count += 1
+    print(f"{label} {filename}: failed after {max_retries} attempts. Skipping.")
+    return False
+
+
+async def process_images_async(input_folder, output_folder, concurrency, rpm=0.0, timeout=120.0, base_url=None,
+                               max_edge=0, quality=92, use_cache=True):
+    client = setup(output_folder, base_url)
+
+    if not os.path.exists(input_folder):
+        print(f"Error: Input folder '{input_folder}' does not exist.")
+        return
+
+    files = sorted([f for f in os.listdir(input_folder) if f.lower().endswith(VALID_EXTENSIONS)])
+    outputs = plan_outputs(files, output_folder)
+    jobs = [(f, outputs[f]) for f in files if outputs[f] is not None]
+
+    print(f"--- Starting Batch Process using {MODEL_NAME} (up to {concurrency} concurrent) ---")
+    print(f"Found {len(files)} images, {len(jobs)} to render.")
+
+    # Start at a quarter of the ceiling and let AIMD find what the quota allows
+    limiter = AdaptiveLimiter(concurrency, rate=rpm / 60.0, burst=max(1, concurrency),
+                              start=max(1, concurrency // 4))
+    prefetch = make_prefetcher(input_folder, output_folder, [f for f, _ in jobs],
+                               max_edge, quality, use_cache, depth=concurrency)
+    start = time.monotonic()
+    results = await asyncio.gather(*[
+        process_one_async(client, limiter, prefetch, os.path.join(input_folder, f), out,
+                          f"[{i + 1}/{len(jobs)}]", timeout)
+        for i, (f, out) in enumerate(jobs)
+    ])
+    elapsed = time.monotonic() - start
+    prefetch.close()
+    print(f"Done: {sum(results)}/{len(jobs)} saved in {elapsed:.0f}s "
+          f"(final concurrency {int(limiter.limit)}).")
+
+
+# --- OFFLINE BATCH JOBS (prepare / ingest) ---
+# `prepare` writes one Batch API request per image to a JSONL file (key = the
+# output filename, so `_c`/`_c2` is decided up front); `ingest` turns the job's
+# results JSONL back into those files. Neither needs the API or a key.
+
+B64_CHUNK = 3 * 256 * 1024  # multiple of 3: chunks encode to independent base64 runs
+
+
+def write_b64(out, source, chunk=B64_CHUNK):
+    """Stream the base64 of a file (or of bytes) into a text file handle, `chunk` bytes at a time."""
+    with (io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')) as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            out.write(base64.b64encode(block).decode("ascii"))
+
+
+def batch_request_parts(key, mime_type):
+    """JSON text before and after the inline image data of one request line."""
+    head = ('{"key": ' + json.dumps(key) + ', "request": {"contents": [{"role": "user", "parts": ['
+            '{"text": ' + json.dumps(PROMPT) + '}, '
+            '{"inline_data": {"mime_type": ' + json.dumps(mime_type) + ', "data": "')
+    tail = '"}}]}], "generation_config": {"response_modalities": ["IMAGE"]}}}\n'
+    return head, tail
+
+
+def prepare_batch(input_folder, output_folder, jsonl_path, max_edge=0, quality=92, shard_mb=0, use_cache=True):
+    """Write a batch-prediction JSONL (sharded at ~shard_mb MB if > 0) for every image still to render."""
+    if not os.path.exists(input_folder):
+        print(f"Error: Input folder '{input_folder}' does not exist.")
+        return []
+    os.makedirs(output_folder, exist_ok=True)
+    files = sorted([f for f in os.listdir(input_folder) if f.lower().endswith(VALID_EXTENSIONS)])
+    outputs = plan_outputs(files, output_folder)
+    jobs = [(f, outputs[f]) for f in files if outputs[f] is not None]
+    cache_dir = os.path.join(output_folder, PAYLOAD_CACHE_DIR) if use_cache else None
+
+    base, ext = os.path.splitext(jsonl_path)
+    shard_path = lambda n: f"{base}-{n:05d}{ext}" if shard_mb > 0 else jsonl_path
+    shards = [shard_path(0)]
+    out = open(shards[0], "w")
+    written = 0
+    try:
+        for index, (filename, output_path) in enumerate(jobs):
+            try:
+                source, mime_type = payload_file(os.path.join(input_folder, filename), max_edge, quality, cache_dir)
+            except Exception as e:
+                print(f"[{index+1}/{len(jobs)}] {filename}: skipped ({e})")
+                continue
+            size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+            if shard_mb > 0 and out.tell() > 0 and out.tell() + size * 4 // 3 > shard_mb * 1e6:
+                out.close()
+                shards.append(shard_path(len(shards)))
+                out = open(shards[-1], "w")
+            head, tail = batch_request_parts(os.path.basename(output_path), mime_type)
+            out.write(head)
+            write_b64(out, source)
+            out.write(tail)
+            written += 1
+            print(f"[{index+1}/{len(jobs)}] {filename} -> {os.path.basename(output_path)}")
+    finally:
+        out.close()
+    print(f"Wrote {written} request(s) to {', '.join(shards)}")
+    return shards
+
+
+INLINE_DATA_RE = re.compile(rb'"(?:inline_data|inlineData)"\s*:\s*\{[^{}]*?"data"\s*:\s*"')
+
+
+def decode_b64_to_file(line, start, out_path, chunk=4 * 256 * 1024):
+    """Decode the JSON base64 string starting at line[start] into out_path; return the index after it."""
+    end = line.index(b'"', start)
+    tmp = out_path + ".tmp"
+    with open(tmp, 'wb') as f:
+        pending = b""
+        for pos in range(start, end, chunk):
+            # JSON may escape "/" as "\/"; keep a trailing backslash for the next block
+            block = pending + line[pos:min(pos + chunk, end)]
+            pending = b"\\" if block.endswith(b"\\") else b""
+            block = (block[:-1] if pending else block).replace(b"\\/", b"/")
+            whole = len(block) // 4 * 4
+            f.write(base64.b64decode(block[:whole]))
+            pending = block[whole:] + pending
+        f.write(base64.b64decode(pending))
+    os.replace(tmp, out_path)
+    return end
+
+
+def ingest_results(results_path, output_folder):
+    """Write the image of every successful line of a batch results JSONL to output_folder/<key>."""
+    os.makedirs(output_folder, exist_ok=True)
+    saved = failed = 0
+    with open(results_path, 'rb') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            match = INLINE_DATA_RE.search(line)
+            if match:
+                # Parse everything but the image data as JSON; decode the data straight to disk
+                meta = json.loads(line[:match.end()] + line[line.index(b'"', match.end()):])
+            else:
+                meta = json.loads(line)
+            key = os.path.basename(str(meta.get("key", "")))
+            if not key:
+                print(f"line {line_no}: no key, skipped")
+                failed += 1
+                continue
+            if not match:
+                print(f"{key}: no image in result ({meta.get('error') or 'empty response'})")
+                failed += 1
+                continue
+            out_path = os.path.join(output_folder, key)
+            if os.path.exists(out_path):
+                print(f"{key}: exists, skipped")
+                continue
+            decode_b64_to_file(line, match.end(), out_path)
+            saved += 1
+            print(f"{key} -> Saved.")
+    print(f"Ingested {saved} image(s), {failed} without one.")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--input", required=True)
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "prepare", "ingest"),
+                        help="run: call the API per image (default); prepare: write a batch-job JSONL; "
+                             "ingest: write the images from a batch results JSONL")
+    parser.add_argument("-i", "--input")
     parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Async mode: max requests in flight (0 = one at a time, the original loop)")
+    parser.add_argument("--rpm", type=float, default=0.0,
+                        help="Async mode: cap on requests per minute (0 = only the 429 feedback limits it)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Async mode: per-request timeout in seconds")
+    parser.add_argument("--base-url", default=None, help="Override the API endpoint (e.g. a local stub server)")
+    parser.add_argument("--max-edge", type=int, default=0,
+                        help="Downscale uploads so the longest edge is <= this (0 = send full resolution)")
+    parser.add_argument("--quality", type=int, default=92, help="JPEG/WEBP quality for re-encoded uploads")
+    parser.add_argument("--no-payload-cache", action="store_true",
+                        help=f"Don't keep re-encoded uploads in <output>/{PAYLOAD_CACHE_DIR}")
+    parser.add_argument("--jsonl", default=None,
+                        help="prepare: requests file to write (default <output>/batch_requests.jsonl)")
+    parser.add_argument("--shard-mb", type=float, default=0,
+                        help="prepare: start a new -NNNNN file after about this many MB (0 = one file)")
+    parser.add_argument("--results", help="ingest: the batch job's results JSONL")
     args = parser.parse_args()
 
-    process_images(args.input, args.output)
+    if args.command != "ingest" and not args.input:
+        parser.error(f"{args.command} needs -i/--input")
+    if args.command == "ingest" and not args.results:
+        parser.error("ingest needs --results")
+
+    use_cache = not args.no_payload_cache
+    if args.command == "prepare":
+        prepare_batch(args.input, args.output, args.jsonl or os.path.join(args.output, "batch_requests.jsonl"),
+                      args.max_edge, args.quality, args.shard_mb, use_cache)
+    elif args.command == "ingest":
+        ingest_results(args.results, args.output)
+    elif args.concurrency > 0:
+        asyncio.run(process_images_async(args.input, args.output, args.concurrency,
+                                         args.rpm, args.timeout, args.base_url,
+                                         args.max_edge, args.quality, use_cache))
+    else:
+        process_images(args.input, args.output, args.base_url, args.max_edge, args.quality, use_cache)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+batch_pool.py — Shared worker-pool engine for the batch correctors.
+
+Runs a per-file function across a process pool and yields the results back to
+the parent in INPUT order, so logs stay deterministic no matter which worker
+finishes first. Each task's exceptions are captured in the worker and returned
+as an error string, so one bad file never stalls or kills the batch.
+
+    from batch_pool import run_tasks
+    for task, result, err in run_tasks(process_one, tasks, jobs=8):
+        ...
+
+jobs <= 1 runs inline (no pool); jobs == 0 means "all cores" via resolve_jobs().
+"""
+
+import os, traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterator, Optional, Sequence, Tuple
+
+def resolve_jobs(jobs: int) -> int:
+    """0 (or negative) -> os.cpu_count(); otherwise the value itself."""
+    if jobs is None or jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+class _Broken(str):
+    """Error string marking a dead pool (vs. an ordinary per-task failure)."""
+
+def _init_worker():
+    # N processes x M OpenCV threads oversubscribes the box; one thread per worker.
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+
+def _call(fn: Callable, task: Tuple) -> Tuple[Any, Optional[str]]:
+    try:
+        return fn(*task), None
+    except Exception as e:
+        return None, f"{e}\n{traceback.format_exc()}"
+
+def run_tasks(fn: Callable, tasks: Sequence[Tuple], jobs: int = 1,
+              window: int = 0) -> Iterator[Tuple[Tuple, Any, Optional[str]]]:
+    """Yield (task, result, error) for every task, in input order.
+
+    `fn` must be a module-level function (picklable); each task is a tuple of its
+    positional args. At most `window` tasks are in flight (default 4 x jobs) so
+    a huge batch does not queue thousands of futures up front.
+    """
+    jobs = resolve_jobs(jobs)
+    if jobs <= 1 or len(tasks) <= 1:
+        for t in tasks:
+            res, err = _call(fn, t)
+            yield t, res, err
+        return
+
+    window = window or jobs * 4
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as ex:
+        pending = []
+        it = iter(tasks)
+        broken = None
+        for t in it:
+            pending.append((t, ex.submit(_call, fn, t)))
+            if len(pending) < window:
+                continue
+            t0, fut = pending.pop(0)
+            res, err = _result(fut)
+            yield t0, res, err
+            if isinstance(err, _Broken):
+                broken = err; break
+        if broken is None:
+            while pending:
+                t0, fut = pending.pop(0)
+                res, err = _result(fut)
+                yield t0, res, err
+                if isinstance(err, _Broken):
+                    broken = err; break
+        if broken is not None:
+            # A worker died hard (segfault/OOM kill); the pool is unusable. Report
+            # the rest as failed instead of hanging.
+            for t0, _ in pending:
+                yield t0, None, broken
+            for t0 in it:
+                yield t0, None, broken
+
+def _result(fut) -> Tuple[Any, Optional[str]]:
+    try:
+        return fut.result()
+    except BrokenProcessPool as e:
+        return None, _Broken(f"worker pool broken: {e}")
+    except Exception as e:
+        return None, f"{e}"
@@ -19,7 +19,16 @@ CLI (full)
 python box_split_ff0000.py \
   --input "/path/to/marked_or_folder" \
   --out "/path/to/out" \
-  --overlay --autocorrect
+  --overlay --autocorrect --jobs 0
+
+Pages run in --jobs worker processes; within a page, crop correction and
+encoding run on --io-threads threads. <out>/box_split_summary.json lists each
+page's crop count and timings.
+
+Parameter sweep (decode once, rank every combination; writes no crops)
+----------------------------------------------------------------------
+python box_split_ff0000.py --input marked.jpg --out sweep/ --sweep --target-boxes 4 \
+  --rmin 220,235 --gmax 40,25 --bmax 40,25 --dilate 5,7 --edge-thresh 0.05,0.2 --margin 2,8
 
 Tweaks (rarely needed)
 ----------------------
@@ -27,23 +36,19 @@ Tweaks (rarely needed)
 --margin 2           # extra inset after detecting inner edge
 --rmin 220 --gmax 40 --bmax 40  # RGB tolerance for red
 --dilate 6           # morphology to fuse frame segments
+--coarse 4           # big scans: locate markers at 1/4 scale, full-res mask only along their edges
 """
 
-import os, sys, glob, argparse, json
+import os, sys, glob, argparse, json, time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 import numpy as np
 import cv2
 
+from batch_pool import run_tasks
+from correct_pipeline import WB, levels, run_chain, imread_color, ensure_dir
+
 # ---------------- IO helpers ----------------
-def imread_color(path: str):
-    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-    if img is None:
-        img = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img is None:
-        raise FileNotFoundError(f"Could not read: {path}")
-    return img
-
-def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
 def clamp(v, a, b): return max(a, min(b, v))
 
 def list_images(p: str):
@@ -56,116 +61,283 @@ def list_images(p: str):
     return [p]
 
 # --------------- Auto-correct ---------------
-def auto_levels_per_channel(img_bgr, low_q=0.01, high_q=0.99):
-    out = img_bgr.astype(np.float32)
-    for c in range(3):
-        ch = out[:,:,c]
-        lo = float(np.quantile(ch, low_q)); hi = float(np.quantile(ch, high_q))
-        if hi <= lo + 1e-6: continue
-        out[:,:,c] = np.clip((ch - lo) * (255.0/(hi - lo)), 0, 255)
-    return out.astype(np.uint8)
-
-def gray_world_wb(img_bgr):
-    b,g,r = cv2.split(img_bgr.astype(np.float32))
-    mb, mg, mr = [np.mean(x) + 1e-6 for x in (b,g,r)]
-    avg = (mb + mg + mr)/3.0
-    b *= (avg/mb); g *= (avg/mg); r *= (avg/mr)
-    return np.clip(cv2.merge((b,g,r)), 0, 255).astype(np.uint8)
-
-def auto_correct(img_bgr): return auto_levels_per_channel(gray_world_wb(img_bgr), 0.01, 0.99)
+AUTO_CORRECT = [WB, levels(0.01, 0.99)]  # same chain as auto_correct_photos.py defaults
+def auto_correct(img_bgr): return run_chain(img_bgr, AUTO_CORRECT)
 
 # --------------- Red mask -------------------
-def red_mask(img_bgr, rmin=220, gmax=40, bmax=40, dilate=6):
-    b,g,r = cv2.split(img_bgr)
-    m = (r >= rmin) & (g <= gmax) & (b <= bmax)
-    m = m.astype(np.uint8) * 255
+def red_threshold(img_bgr, rmin=220, gmax=40, bmax=40):
+    """0/255 plane of red pixels: r >= rmin, g <= gmax, b <= bmax, in one inRange pass."""
+    return cv2.inRange(img_bgr, (0, 0, rmin), (bmax, gmax, 255))
+
+def _fuse(m, dilate):
     m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, np.ones((3,3), np.uint8), iterations=1)
     if dilate > 0:
         m = cv2.dilate(m, np.ones((dilate, dilate), np.uint8), iterations=1)
     return m
 
+def red_mask(img_bgr, rmin=220, gmax=40, bmax=40, dilate=6):
+    return _fuse(red_threshold(img_bgr, rmin, gmax, bmax), dilate)
+
+def red_region(img_bgr, x1, y1, x2, y2, rmin=220, gmax=40, bmax=40, dilate=6):
+    """red_mask(img_bgr)[y1:y2, x1:x2], exactly, from just that rectangle plus enough context for the morphology."""
+    H,W = img_bgr.shape[:2]
+    pad = dilate + 4                 # close (2 px) + dilate (<= dilate px) + slack
+    cy1, cy2, cx1, cx2 = max(0, y1-pad), min(H, y2+pad), max(0, x1-pad), min(W, x2+pad)
+    m = red_mask(img_bgr[cy1:cy2, cx1:cx2], rmin, gmax, bmax, dilate)
+    return m[y1-cy1:y2-cy1, x1-cx1:x2-cx1]
+
+def _attached(m, inner):
+    """Pixels of strip m in 8-connected components that reach its `inner` edge (the side facing the marker)."""
+    n, labels = cv2.connectedComponents(m)
+    keep = np.zeros(n, bool); keep[labels[inner]] = True; keep[0] = False
+    return keep[labels]
+
+def red_boxes_coarse(img_bgr, min_size_w, min_size_h, rmin=220, gmax=40, bmax=40, dilate=6, factor=4):
+    """outer_boxes() without a full-page mask: (boxes, region(x1,y1,x2,y2) -> mask there, coarse mask).
+
+    Markers are found on a 1/factor subsample; each box edge is then placed at
+    full resolution from a strip of red_region() factor+pad px either side of
+    its coarse position, counting only red connected to the marker's side of
+    the strip (so specks beside it don't stretch the box). inner_bbox() reads the mask through `region`, so only
+    the bands it actually scans are thresholded at full resolution.
+
+    Boxes match outer_boxes(red_mask(...)) except that an outer edge can move
+    by up to factor+pad px where a speck reaching into the strip sits next to
+    (not touching) the marker, and markers closer than about 2*factor px merge.
+    The inner boxes, and so the crops, are unaffected by such specks.
+    """
+    H,W = img_bgr.shape[:2]
+    prm = dict(rmin=rmin, gmax=gmax, bmax=bmax, dilate=dilate)
+    def region(x1, y1, x2, y2): return red_region(img_bgr, x1, y1, x2, y2, **prm)
+    # INTER_NEAREST at an integer scale == img[::factor, ::factor], without the strided copy
+    small = cv2.resize(img_bgr, (-(-W // factor), -(-H // factor)), interpolation=cv2.INTER_NEAREST)
+    small = cv2.dilate(red_threshold(small, rmin, gmax, bmax), np.ones((3,3), np.uint8))   # bridge sampling gaps
+    contours,_ = cv2.findContours(small, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    e = factor + dilate + 4
+    min_w, min_h = int(W*min_size_w), int(H*min_size_h)
+    boxes = []
+    for c in contours:
+        sx,sy,sw,sh = cv2.boundingRect(c)
+        X1, Y1, X2, Y2 = sx*factor, sy*factor, min(W, (sx+sw)*factor), min(H, (sy+sh)*factor)
+        if X2 - X1 + 2*e < min_w or Y2 - Y1 + 2*e < min_h:
+            continue
+        ax1, ax2 = max(0, X1-e), min(W, X2+e)
+        top = np.flatnonzero(_attached(region(ax1, max(0, Y1-e), ax2, min(H, Y1+e)), np.s_[-1]).any(axis=1))
+        bot = np.flatnonzero(_attached(region(ax1, max(0, Y2-e), ax2, min(H, Y2+e)), np.s_[0]).any(axis=1))
+        y1 = max(0, Y1-e) + top[0] if len(top) else Y1
+        y2 = max(0, Y2-e) + bot[-1] + 1 if len(bot) else Y2
+        left = np.flatnonzero(_attached(region(max(0, X1-e), y1, min(W, X1+e), y2), np.s_[:, -1]).any(axis=0))
+        right = np.flatnonzero(_attached(region(max(0, X2-e), y1, min(W, X2+e), y2), np.s_[:, 0]).any(axis=0))
+        x1 = max(0, X1-e) + left[0] if len(left) else X1
+        x2 = max(0, X2-e) + right[-1] + 1 if len(right) else X2
+        if x2 - x1 < min_w or y2 - y1 < min_h:
+            continue
+        boxes.append((int(x1),int(y1),int(x2),int(y2)))
+    boxes.sort(key=lambda b: (b[1]//100, b[0]))
+    return boxes, region, small
+
 # --------------- Inner box estimation -------
-def inner_bbox_from_mask(mask, bbox, edge_thresh=0.05, max_search_ratio=0.25):
-    """Scan from each side; stop when red FRACTION < edge_thresh (default 5%)."""
+def _inner_offset(fracs, lim, edge_thresh, first_band=64):
+    """First line after the red frame, scanning from line 0 up to lim; fracs(a, b) = red fraction of lines a..b-1.
+
+    Same answer as testing line by line: enter the frame at the first line whose
+    red fraction is >= edge_thresh, return the first line after that below it;
+    if either transition is missing, fall back conservatively to max(1, lim//4).
+    Fractions are requested for a band of lines at a time (doubling from
+    first_band), so a typical frame costs one count_nonzero over ~64 lines.
+    """
+    on = np.zeros(0, bool)
+    while len(on) < lim:
+        stop = min(lim, max(first_band, 2 * len(on)))
+        on = np.concatenate([on, fracs(len(on), stop) >= edge_thresh])
+        if on.any():
+            enter = int(np.argmax(on))
+            off = ~on[enter:]
+            if off.any():
+                return enter + int(np.argmax(off))
+    return max(1, lim//4)
+
+def inner_bbox(region, bbox, edge_thresh=0.05, max_search_ratio=0.25):
+    """Scan from each side; stop when red FRACTION < edge_thresh. region(x1, y1, x2, y2) gives the mask there."""
     x1,y1,x2,y2 = bbox
-    roi = mask[y1:y2, x1:x2]
-    H,W = roi.shape[:2]
-    max_top = max(1, int(H * max_search_ratio))
-    max_left = max(1, int(W * max_search_ratio))
-
-    def inner_offset(lines, along_rows=True, limit=None):
-        lim = (max_top if along_rows else max_left) if limit is None else limit
-        lim = min(lim, (lines.shape[0] if along_rows else lines.shape[1]) - 1)
-        entered = False
-        for i in range(lim):
-            frac = np.mean(lines[i, :] > 0) if along_rows else np.mean(lines[:, i] > 0)
-            if not entered:
-                if frac >= edge_thresh:
-                    entered = True   # on the red frame now
-                # else: still outside; keep moving
-            else:
-                if frac < edge_thresh:
-                    return i  # first interior row/col after leaving frame
-        # Fallback if we never saw both enter+exit: be conservative
-        return max(1, lim//4)
+    H,W = y2-y1, x2-x1
+    lim_rows = min(max(1, int(H * max_search_ratio)), H - 1)
+    lim_cols = min(max(1, int(W * max_search_ratio)), W - 1)
 
-    top = inner_offset(roi, along_rows=True)
-    bottom = inner_offset(np.flipud(roi), along_rows=True)
-    left = inner_offset(roi, along_rows=False)
-    right = inner_offset(np.fliplr(roi), along_rows=False)
+    top = _inner_offset(lambda a,b: np.count_nonzero(region(x1, y1+a, x2, y1+b), axis=1) / W, lim_rows, edge_thresh)
+    bottom = _inner_offset(lambda a,b: np.count_nonzero(region(x1, y2-b, x2, y2-a), axis=1)[::-1] / W, lim_rows, edge_thresh)
+    left = _inner_offset(lambda a,b: np.count_nonzero(region(x1+a, y1, x1+b, y2), axis=0) / H, lim_cols, edge_thresh)
+    right = _inner_offset(lambda a,b: np.count_nonzero(region(x2-b, y1, x2-a, y2), axis=0)[::-1] / H, lim_cols, edge_thresh)
 
     return x1 + left, y1 + top, x2 - right, y2 - bottom
 
+def inner_bbox_from_mask(mask, bbox, edge_thresh=0.05, max_search_ratio=0.25):
+    """Scan from each side; stop when red FRACTION < edge_thresh (default 5%)."""
+    return inner_bbox(lambda x1, y1, x2, y2: mask[y1:y2, x1:x2], bbox, edge_thresh, max_search_ratio)
+
+def outer_boxes(mask, W, H, min_size_w, min_size_h):
+    """Bounding boxes of the red regions big enough to be markers, in reading order."""
+    contours,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    min_w, min_h = int(W*min_size_w), int(H*min_size_h)
+    for c in contours:
+        x,y,wc,hc = cv2.boundingRect(c)
+        if wc < min_w or hc < min_h:
+            continue
+        boxes.append((x,y,x+wc,y+hc))
+    boxes.sort(key=lambda b: (b[1]//100, b[0]))
+    return boxes
+
+def crop_rect(inner, margin, W, H):
+    """Inner box inset by margin and clamped to the page; None if nothing is left."""
+    in_x1,in_y1,in_x2,in_y2 = inner
+    xi1 = clamp(in_x1 + margin, 0, W-1)
+    yi1 = clamp(in_y1 + margin, 0, H-1)
+    xi2 = clamp(in_x2 - margin, 0, W-1)
+    yi2 = clamp(in_y2 - margin, 0, H-1)
+    if xi2 <= xi1 or yi2 <= yi1:
+        return None
+    return xi1, yi1, xi2, yi2
+
 # --------------- Per-image process ----------
+def write_image(out_path, img, fmt, quality):
+    if fmt.lower() in ("jpg","jpeg"):
+        cv2.imwrite(out_path, img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    else:
+        cv2.imwrite(out_path, img)
+
+def write_crop(img, rect, out_path, args):
+    xi1,yi1,xi2,yi2 = rect
+    crop = img[yi1:yi2, xi1:xi2]
+    if args.autocorrect:
+        crop = auto_correct(crop)
+    write_image(out_path, crop, args.format, args.quality)
+
 def process_image(path, out_root, args):
+    """Split one page; returns its summary record (crop count + per-stage seconds)."""
+    t0 = time.perf_counter()
     img = imread_color(path)
     H,W = img.shape[:2]
     base = os.path.splitext(os.path.basename(path))[0]
     out_dir = os.path.join(out_root, base)
     ensure_dir(out_dir)
+    t1 = time.perf_counter()
 
-    mask = red_mask(img, rmin=args.rmin, gmax=args.gmax, bmax=args.bmax, dilate=args.dilate)
-    if args.dump_mask:
-        cv2.imwrite(os.path.join(out_dir, f"{base}_mask.png"), mask)
+    if args.coarse > 1:
+        boxes, region, mask = red_boxes_coarse(img, args.min_size_w, args.min_size_h, rmin=args.rmin, gmax=args.gmax,
+                                               bmax=args.bmax, dilate=args.dilate, factor=args.coarse)
+    else:
+        mask = red_mask(img, rmin=args.rmin, gmax=args.gmax, bmax=args.bmax, dilate=args.dilate)
+        boxes = outer_boxes(mask, W, H, args.min_size_w, args.min_size_h)
+        def region(x1, y1, x2, y2): return mask[y1:y2, x1:x2]
 
-    contours,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    boxes = []
-    min_w, min_h = int(W*args.min_size_w), int(H*args.min_size_h)
-    for c in contours:
-        x,y,wc,hc = cv2.boundingRect(c)
-        if wc < min_w or hc < min_h: 
-            continue
-        boxes.append((x,y,x+wc,y+hc))
-    boxes.sort(key=lambda b: (b[1]//100, b[0]))
+    # Each inner box is found once and shared by the crops, overlay and report
+    inners = [inner_bbox(region, b, edge_thresh=args.edge_thresh, max_search_ratio=args.max_search) for b in boxes]
+    t2 = time.perf_counter()
 
-    crops = []
-    for i,b in enumerate(boxes,1):
-        in_x1,in_y1,in_x2,in_y2 = inner_bbox_from_mask(mask, b, edge_thresh=args.edge_thresh, max_search_ratio=args.max_search)
-        xi1 = clamp(in_x1 + args.margin, 0, W-1)
-        yi1 = clamp(in_y1 + args.margin, 0, H-1)
-        xi2 = clamp(in_x2 - args.margin, 0, W-1)
-        yi2 = clamp(in_y2 - args.margin, 0, H-1)
-        if xi2 <= xi1 or yi2 <= yi1: 
-            continue
-        crop = img[yi1:yi2, xi1:xi2].copy()
-        if args.autocorrect:
-            crop = auto_correct(crop)
-        out_name = f"{base}_crop_{i:02d}.{args.format}"
-        out_path = os.path.join(out_dir, out_name)
-        if args.format.lower() in ("jpg","jpeg"):
-            cv2.imwrite(out_path, crop, [int(cv2.IMWRITE_JPEG_QUALITY), int(args.quality)])
-        else:
-            cv2.imwrite(out_path, crop)
-        crops.append(out_path)
+    # Crops (and the debug images) are corrected/encoded on threads; cv2 drops the GIL
+    crops, report, pending = [], [], []
+    with ThreadPoolExecutor(max_workers=max(1, args.io_threads)) as pool:
+        if args.dump_mask:
+            pending.append(pool.submit(cv2.imwrite, os.path.join(out_dir, f"{base}_mask.png"), mask))
+        for i,(b,inner) in enumerate(zip(boxes, inners),1):
+            rect = crop_rect(inner, args.margin, W, H)
+            entry = {"index": i, "outer": list(b), "inner": list(inner), "crop": list(rect) if rect else None, "file": None}
+            report.append(entry)
+            if rect is None:
+                continue
+            out_name = f"{base}_crop_{i:02d}.{args.format}"
+            out_path = os.path.join(out_dir, out_name)
+            pending.append(pool.submit(write_crop, img, rect, out_path, args))
+            crops.append(out_path)
+            entry["file"] = out_name
+
+        if args.overlay:
+            ov = img.copy()
+            for in_x1,in_y1,in_x2,in_y2 in inners:
+                cv2.rectangle(ov,(in_x1,in_y1),(in_x2,in_y2),(0,255,255),6)
+            pending.append(pool.submit(cv2.imwrite, os.path.join(out_dir, f"{base}_overlay_boxes.jpg"), ov))
+
+        if args.box_report:
+            with open(os.path.join(out_dir, f"{base}_boxes.json"), "w") as f:
+                json.dump({"page": path, "width": W, "height": H, "boxes": report}, f, indent=2)
+        for fut in pending:
+            fut.result()   # re-raise the first write error
+    t3 = time.perf_counter()
+
+    return {"page": path, "width": W, "height": H, "boxes": len(boxes), "crops": len(crops),
+            "seconds": {"read": round(t1-t0, 3), "detect": round(t2-t1, 3),
+                        "write": round(t3-t2, 3), "total": round(t3-t0, 3)}}
 
-    if args.overlay:
+# --------------- Parameter sweep ------------
+SWEEP_KEYS = ("rmin", "gmax", "bmax", "dilate", "edge_thresh", "max_search", "margin")
+
+def num_list(cast):
+    """argparse type: "220,235" -> [220, 235]."""
+    return lambda s: [cast(v) for v in s.split(",") if v.strip()]
+
+def sweep_page(path, args):
+    """Score every combination of the SWEEP_KEYS lists on one decode of `path`.
+
+    Work is nested by cost: the colour threshold once per (rmin, gmax, bmax),
+    close/dilate + contours once per dilate on top of it, the inner-edge scan
+    once per (edge_thresh, max_search) and only the crop inset per margin.
+    Ranked by distance from --target-boxes (if given), then marker pixels
+    left inside the crops, then most photo kept. Marker pixels (red_px) are
+    counted against one reference mask at the loosest swept thresholds (lowest
+    rmin, highest gmax/bmax), so a strict row can't look cleaner just because
+    its own mask misses the anti-aliased edge of the same marker.
+    """
+    img = imread_color(path)
+    H,W = img.shape[:2]
+    ref_thr = {"rmin": min(args.rmin), "gmax": max(args.gmax), "bmax": max(args.bmax)}
+    ref = red_threshold(img, ref_thr["rmin"], ref_thr["gmax"], ref_thr["bmax"])
+    rows = []
+    for rmin in args.rmin:
+        for gmax in args.gmax:
+            for bmax in args.bmax:
+                thr = red_threshold(img, rmin, gmax, bmax)
+                for dilate in args.dilate:
+                    mask = _fuse(thr, dilate)
+                    boxes = outer_boxes(mask, W, H, args.min_size_w, args.min_size_h)
+                    for edge in args.edge_thresh:
+                        for ms in args.max_search:
+                            inners = [inner_bbox_from_mask(mask, b, edge_thresh=edge, max_search_ratio=ms) for b in boxes]
+                            for margin in args.margin:
+                                rects = [r for r in (crop_rect(i, margin, W, H) for i in inners) if r]
+                                red = sum(cv2.countNonZero(ref[y1:y2, x1:x2]) for x1,y1,x2,y2 in rects)
+                                area = sum((x2-x1)*(y2-y1) for x1,y1,x2,y2 in rects)
+                                rows.append({"rmin": rmin, "gmax": gmax, "bmax": bmax, "dilate": dilate,
+                                             "edge_thresh": edge, "max_search": ms, "margin": margin,
+                                             "boxes": len(boxes), "crops": len(rects), "red_px": red,
+                                             "crop_frac": round(area / float(W*H), 4), "rects": rects})
+    miss = (lambda r: abs(r["crops"] - args.target_boxes)) if args.target_boxes > 0 else (lambda r: 0)
+    rows.sort(key=lambda r: (miss(r), r["red_px"], -r["crop_frac"]))
+
+    base = os.path.splitext(os.path.basename(path))[0]
+    out_dir = os.path.join(args.out, base)
+    ensure_dir(out_dir)
+    for rank, r in enumerate(rows[:args.sweep_top], 1):
         ov = img.copy()
-        for b in boxes:
-            in_x1,in_y1,in_x2,in_y2 = inner_bbox_from_mask(mask, b, edge_thresh=args.edge_thresh, max_search_ratio=args.max_search)
-            cv2.rectangle(ov,(in_x1,in_y1),(in_x2,in_y2),(0,255,255),6)
-        cv2.imwrite(os.path.join(out_dir, f"{base}_overlay_boxes.jpg"), ov)
+        for x1,y1,x2,y2 in r["rects"]:
+            cv2.rectangle(ov, (x1,y1), (x2,y2), (0,255,255), 6)
+        label = " ".join(f"{k}={r[k]}" for k in SWEEP_KEYS)
+        cv2.putText(ov, label, (20, 60), cv2.FONT_HERSHEY_SIMPLEX, max(1.0, W / 2500.0), (0,255,255), 3)
+        cv2.imwrite(os.path.join(out_dir, f"{base}_sweep_{rank:02d}.jpg"), ov)
+    with open(os.path.join(out_dir, f"{base}_sweep.json"), "w") as f:
+        json.dump({"page": path, "width": W, "height": H, "target_boxes": args.target_boxes,
+                   "red_px_mask": ref_thr,
+                   "ranked": [{k: (list(map(list, v)) if k == "rects" else v) for k, v in r.items()} for r in rows]},
+                  f, indent=2)
+    return rows
 
-    return len(crops)
+def print_sweep(path, rows, top):
+    cols = SWEEP_KEYS + ("crops", "red_px", "crop_frac")
+    print(f"== {path}: {len(rows)} combination(s)")
+    print("rank " + " ".join(f"{c:>11}" for c in cols))
+    for rank, r in enumerate(rows[:top], 1):
+        print(f"{rank:>4} " + " ".join(f"{r[c]:>11}" for c in cols))
 
 # --------------- CLI ------------------------
 def main():
@@ -174,23 +346,57 @@ def main():
     ap.add_argument("--out", required=True, help="Output directory")
     ap.add_argument("--overlay", action="store_true", help="Write inner-box overlay")
     ap.add_argument("--dump-mask", action="store_true", help="Write red mask")
+    ap.add_argument("--box-report", action="store_true", help="Write <page>_boxes.json (outer/inner/crop boxes per marker)")
     ap.add_argument("--autocorrect", action="store_true", help="Apply auto WB + levels to crops")
     # Good defaults
-    ap.add_argument("--margin", type=int, default=2, help="Extra inset past inner edge (px)")
-    ap.add_argument("--edge-thresh", type=float, default=0.05, help="Row/col counts as frame if red fraction >= this")
-    ap.add_argument("--rmin", type=int, default=220); ap.add_argument("--gmax", type=int, default=40); ap.add_argument("--bmax", type=int, default=40)
-    ap.add_argument("--dilate", type=int, default=6, help="Dilation to fuse frame segments (px)")
+    # These seven take comma lists with --sweep
+    ap.add_argument("--margin", type=num_list(int), default="2", help="Extra inset past inner edge (px)")
+    ap.add_argument("--edge-thresh", type=num_list(float), default="0.05", help="Row/col counts as frame if red fraction >= this")
+    ap.add_argument("--rmin", type=num_list(int), default="220"); ap.add_argument("--gmax", type=num_list(int), default="40"); ap.add_argument("--bmax", type=num_list(int), default="40")
+    ap.add_argument("--dilate", type=num_list(int), default="6", help="Dilation to fuse frame segments (px)")
     ap.add_argument("--min-size-w", type=float, default=0.06, help="Min width fraction of page")
     ap.add_argument("--min-size-h", type=float, default=0.06, help="Min height fraction of page")
     ap.add_argument("--format", default="jpg", choices=["jpg","png","tiff"]); ap.add_argument("--quality", type=int, default=92)
-    ap.add_argument("--max-search", type=float, default=0.25, help="Max fraction of the bbox to scan from each edge")
+    ap.add_argument("--max-search", type=num_list(float), default="0.25", help="Max fraction of the bbox to scan from each edge")
+    ap.add_argument("--coarse", type=int, default=0,
+                    help="Find markers on a 1/N subsample, then threshold at full res only along their edges; "
+                         "--dump-mask then writes the 1/N mask (0=whole page)")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes over pages (0 = all cores, 1 = serial)")
+    ap.add_argument("--io-threads", type=int, default=4, help="Threads per page for crop correction + encoding")
+    ap.add_argument("--sweep", action="store_true", help="Rank every combination of the comma-list options instead of cropping")
+    ap.add_argument("--target-boxes", type=int, default=0, help="Sweep: expected crops per page (0 = no target)")
+    ap.add_argument("--sweep-top", type=int, default=5, help="Sweep: rows to print and overlays to write")
     args = ap.parse_args()
 
     ensure_dir(args.out)
     files = list_images(args.input)
-    total_crops = 0
-    for f in files:
-        total_crops += process_image(f, args.out, args)
+    if args.sweep:
+        for (f,_), rows, err in run_tasks(sweep_page, [(f, args) for f in files], args.jobs):
+            if err:
+                print(f"  ! Error sweeping {f}: {err.splitlines()[0]}")
+            else:
+                print_sweep(f, rows, args.sweep_top)
+        return
+    for k in SWEEP_KEYS:
+        v = getattr(args, k)
+        if len(v) != 1:
+            ap.error(f"--{k.replace('_', '-')}: one value expected (comma lists need --sweep)")
+        setattr(args, k, v[0])
+    t0 = time.perf_counter()
+    pages, total_crops = [], 0
+    for idx, ((f,_,_), rec, err) in enumerate(run_tasks(process_image, [(f, args.out, args) for f in files], args.jobs), 1):
+        if err:
+            print(f"[{idx}/{len(files)}] {f}\n  ! Error: {err.splitlines()[0]}")
+            rec = {"page": f, "error": err.splitlines()[0]}
+        else:
+            print(f"[{idx}/{len(files)}] {f} -> {rec['crops']} crop(s) in {rec['seconds']['total']:.2f}s")
+            total_crops += rec["crops"]
+        pages.append(rec)
+
+    summary = {"pages": pages, "total_pages": len(files), "total_crops": total_crops,
+               "failed": sum(1 for p in pages if "error" in p), "seconds": round(time.perf_counter() - t0, 3)}
+    with open(os.path.join(args.out, "box_split_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
 
     print(f"[DONE] Crops written: {total_crops}")
 
@@ -6,13 +6,32 @@ convert_tif_to_jpg.py — Recursively convert .tif/.tiff images to .jpg next to
 - Minimal compression loss (JPEG quality 95 by default).
 - Leaves originals untouched.
 - Drops new .jpg files alongside originals.
+- Skips TIFFs whose .jpg is already newer (rerun after an interrupt to resume);
+  --verify-hash instead trusts a manifest of size/mtime/SHA-1 + quality.
+- Writes each .jpg to a temp file and renames it, so a killed run never leaves
+  a truncated .jpg behind.
+- 16-bit (48-bit RGB) scans are tone-mapped to 8 bits with one global range
+  taken from the image histogram (--tone-low/--tone-high quantiles).
+- --stream decodes strip by strip / tile by tile (needs `pip install tifffile`),
+  so only the 8-bit result and a few strips are in memory, never the 16-bit frame.
+  LZW/JPEG-compressed TIFFs stream only with `pip install imagecodecs`; without
+  it they are decoded whole as usual.
 
 Usage:
-  python convert_tif_to_jpg.py --input "/path/to/folder" --recursive
+  python convert_tif_to_jpg.py --input "/path/to/folder" --recursive --jobs 0
+  python convert_tif_to_jpg.py --input "/path/to/panoramas" --stream
 """
 
 import os, argparse, glob, cv2, numpy as np
 
+from batch_pool import run_tasks
+from levels_lut import hist_quantile
+from skip_cache import SkipManifest, effective_params
+
+_U16 = np.arange(65536, dtype=np.float64)
+STREAM_PHOTOMETRIC = (1, 2)   # tifffile PHOTOMETRIC.MINISBLACK, RGB
+STREAM_BUFFER = 16 << 20       # compressed bytes tifffile reads ahead
+
 def imread_any(path: str):
     img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
     if img is None:
@@ -28,10 +47,38 @@ def list_tifs(root: str, recursive: bool):
         files.extend(glob.glob(os.path.join(root, "**" if recursive else "", pat), recursive=recursive))
     return sorted(files)
 
-def convert_one(src: str, quality: int = 95):
-    base, _ = os.path.splitext(src)
-    dst = base + ".jpg"
+def jpg_path(src: str) -> str:
+    return os.path.splitext(src)[0] + ".jpg"
+
+def up_to_date(src: str, dst: str) -> bool:
+    """The .jpg exists, is non-empty and is at least as new as the TIFF."""
+    try:
+        s, d = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return d.st_size > 0 and d.st_mtime_ns >= s.st_mtime_ns
+
+def write_atomic(dst: str, data: bytes):
+    tmp = dst + ".part"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def tone_lut(hist: np.ndarray, low_q=0.0001, high_q=0.9999) -> np.ndarray:
+    """uint16 -> uint8 LUT stretching the low_q..high_q quantiles of `hist` (65536 bins) to 0..255."""
+    lo = hist_quantile(hist, _U16, low_q); hi = hist_quantile(hist, _U16, high_q)
+    if hi <= lo: hi = lo + 1.0
+    return np.clip((_U16 - lo) * (255.0/(hi - lo)) + 0.5, 0, 255).astype(np.uint8)
+
+def full_to_8bit(src: str, low_q=0.0001, high_q=0.9999):
     img = imread_any(src)
+    if img.dtype == np.uint16:
+        planes = img if img.ndim == 2 else img[:, :, :3]
+        img = tone_lut(np.bincount(planes.ravel(), minlength=65536), low_q, high_q)[img]
 
     # Handle multi-channel/alpha TIFFs
     if img.ndim == 2:
@@ -40,19 +87,81 @@ def convert_one(src: str, quality: int = 95):
         bgr = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
     else:
         bgr = img
+    return bgr
 
-    ok = cv2.imwrite(dst, bgr, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
-    if ok:
-        print(f"Converted: {src} -> {dst}")
-    else:
-        print(f"FAILED: {src}")
+def has_codec(page) -> bool:
+    """tifffile can decompress (and un-predict) this page without optional codec packages."""
+    from tifffile import TIFF
+    try:
+        TIFF.DECOMPRESSORS[page.compression]; TIFF.UNPREDICTORS[page.predictor]
+    except (KeyError, ValueError):
+        return False
+    return True
+
+def stream_to_8bit(src: str, low_q=0.0001, high_q=0.9999):
+    """8-bit BGR frame decoded one strip/tile at a time; None if the layout isn't streamable.
+
+    16-bit data takes two passes over the segments: a histogram for the global
+    tone range, then LUT + copy into the output. Compressions tifffile can't
+    decode on its own (LZW, JPEG, ... without imagecodecs) also give None, so
+    the caller falls back to the full decode.
+    """
+    import tifffile
+    with tifffile.TiffFile(src) as tif:
+        page = tif.pages[0]
+        if (page.dtype not in (np.uint8, np.uint16) or int(page.planarconfig) != 1
+                or int(page.photometric) not in STREAM_PHOTOMETRIC or not has_codec(page)):
+            return None
+        H, W, spp = page.imagelength, page.imagewidth, page.samplesperpixel
+        color = spp >= 3
+
+        def segments():
+            for seg, (_, _, y, x, _), _ in page.segments(maxworkers=1, buffersize=STREAM_BUFFER):
+                if seg is None:
+                    continue   # sparse file: missing strip stays black
+                seg = seg[0, :H - y, :W - x]   # edge strips/tiles are padded
+                yield y, x, (seg[..., 2::-1] if color else seg[..., 0])   # RGB -> BGR, drop alpha
+
+        lut = None
+        if page.dtype == np.uint16:
+            hist = np.zeros(65536, np.int64)
+            for _, _, seg in segments():
+                hist += np.bincount(seg.ravel(), minlength=65536)
+            lut = tone_lut(hist, low_q, high_q)
+        out = np.zeros((H, W, 3) if color else (H, W), np.uint8)
+        for y, x, seg in segments():
+            out[y:y + seg.shape[0], x:x + seg.shape[1]] = seg if lut is None else lut[seg]
+    return out if color else cv2.cvtColor(out, cv2.COLOR_GRAY2BGR)   # same 3-channel JPEG as full_to_8bit
+
+def convert_one(src: str, quality: int = 95, stream: bool = False, low_q=0.0001, high_q=0.9999) -> str:
+    dst = jpg_path(src)
+    bgr = stream_to_8bit(src, low_q, high_q) if stream else None
+    if bgr is None:
+        bgr = full_to_8bit(src, low_q, high_q)
+    ok, buf = cv2.imencode(".jpg", bgr, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise RuntimeError("JPEG encode failed")
+    write_atomic(dst, buf.tobytes())
+    return dst
 
 def main():
     ap = argparse.ArgumentParser(description="Convert .tif/.tiff to .jpg next to originals.")
     ap.add_argument("--input", required=True, help="Input file or directory")
     ap.add_argument("--recursive", action="store_true", help="Recurse into subfolders")
     ap.add_argument("--quality", type=int, default=95, help="JPEG quality (default 95)")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = all cores, 1 = serial)")
+    ap.add_argument("--verify-hash", action="store_true",
+                    help="Skip by manifest (size+mtime, SHA-1 if only the mtime moved, same --quality) instead of 'jpg is newer'")
+    ap.add_argument("--force", action="store_true", help="Convert every file, even if its .jpg looks up to date")
+    ap.add_argument("--stream", action="store_true", help="Decode strip/tile-wise with bounded memory (needs tifffile)")
+    ap.add_argument("--tone-low", type=float, default=0.0001, help="16-bit input: quantile mapped to black")
+    ap.add_argument("--tone-high", type=float, default=0.9999, help="16-bit input: quantile mapped to white")
     args = ap.parse_args()
+    if args.stream:
+        try:
+            import tifffile
+        except ImportError:
+            ap.error("--stream needs tifffile: pip install tifffile")
 
     if os.path.isfile(args.input):
         files = [args.input]
@@ -63,12 +172,27 @@ def main():
         print("No TIFF files found."); return
 
     print(f"Found {len(files)} TIFF files.")
-    for i, f in enumerate(files, 1):
-        print(f"[{i}/{len(files)}] {f}")
-        try:
-            convert_one(f, quality=args.quality)
-        except Exception as e:
-            print(f"  ! Error converting {f}: {e}")
+    manifest = None
+    if args.verify_hash:
+        root = args.input if os.path.isdir(args.input) else os.path.dirname(os.path.abspath(args.input))
+        manifest = SkipManifest(root, "convert_tif_to_jpg", effective_params(args, ignore=("verify_hash", "stream")),
+                                enabled=not args.force)
+        todo = [f for f in files if manifest.check(f, [jpg_path(f)]) is None]
+    else:
+        todo = files if args.force else [f for f in files if not up_to_date(f, jpg_path(f))]
+    if len(todo) < len(files):
+        print(f"Skipping {len(files) - len(todo)} up-to-date file(s) (use --force to redo them).")
+
+    for i, ((f, *_), dst, err) in enumerate(run_tasks(convert_one, [(f, args.quality, args.stream, args.tone_low, args.tone_high) for f in todo], args.jobs), 1):
+        print(f"[{i}/{len(todo)}] {f}")
+        if err:
+            print(f"  ! Error converting {f}: {err.splitlines()[0]}")
+            continue
+        print(f"Converted: {f} -> {dst}")
+        if manifest is not None:
+            manifest.record(f, [dst])
+    if manifest is not None:
+        manifest.save()
 
     print("Done.")
 
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+correct_pipeline.py — Shared IO, correction operators and composable stages.
+
+auto_correct_photos.py, auto_correct_bw.py and auto_correct_smart.py all build
+their corrections from the stages here, and auto_correct_multi.py runs several of
+them off ONE decode per file.
+
+A Stage is a (key, fn) pair; a chain is a list of stages. StageCache applies
+chains to one decoded image and keeps the intermediate result of every prefix
+that more than one planned chain shares, so e.g. `_ac` (wb -> levels) and the
+smart colour branch (wb -> de-yellow -> saturation -> levels) run gray-world
+white balance once:
+
+    cache = StageCache(img, plan=[ac_chain, color_chain])
+    ac = cache.run(ac_chain)
+    color = cache.run(color_chain)     # reuses the wb result
+"""
+
+import os, glob
+from collections import namedtuple
+from typing import Iterable, List, Optional, Sequence
+import numpy as np
+import cv2
+
+from levels_lut import levels_gray, levels_per_channel, plane_hist
+
+# ---------------- IO ----------------
+def imread_color(path: str):
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"Could not read: {path}")
+    return img
+
+def ensure_dir(p: str): os.makedirs(p, exist_ok=True)
+
+def list_images(root: str, exts: List[str], recursive: bool) -> List[str]:
+    if os.path.isfile(root):
+        return [root]
+    pats = []
+    for e in exts:
+        pats += [f"**/*.{e}", f"**/*.{e.upper()}"] if recursive else [f"*.{e}", f"*.{e.upper()}"]
+    files: List[str] = []
+    for pat in pats:
+        files.extend(glob.glob(os.path.join(root, pat), recursive=recursive))
+    files = sorted(set(f for f in files if os.path.isfile(f)))
+    return files
+
+def resize_max_edge(img: np.ndarray, max_edge: int) -> np.ndarray:
+    if max_edge <= 0: return img
+    h, w = img.shape[:2]; m = max(h, w)
+    if m <= max_edge: return img
+    s = max_edge / float(m)
+    return cv2.resize(img, (int(round(w*s)), int(round(h*s))), interpolation=cv2.INTER_AREA)
+
+def out_path_for(src: str, input_arg: str, in_root: str, out_root: str, suffix: str,
+                 fmt: str = "", inplace: bool = False) -> str:
+    """Mirror `src` under out_root as <name><suffix>.<ext> (or the same name with inplace)."""
+    rel = os.path.relpath(src, in_root) if os.path.isdir(input_arg) else os.path.basename(src)
+    base, ext = os.path.splitext(rel)
+    if inplace:
+        dst_rel = rel if not fmt else base + "." + fmt.lower()
+    else:
+        dst_rel = base + suffix + "." + (fmt.lower() if fmt else ext[1:].lower())
+    return os.path.join(out_root, dst_rel)
+
+def imwrite_params(path: str, quality: int = 92, fmt: str = "") -> List[int]:
+    ext = fmt.lower() if fmt else os.path.splitext(path)[1][1:].lower()
+    if ext in ("jpg", "jpeg"): return [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+    if ext == "png": return [int(cv2.IMWRITE_PNG_COMPRESSION), 3]
+    return []
+
+# ---------------- Correction operators ----------------
+_U8 = np.arange(256, dtype=np.float32)
+
+def gray_world_wb(img_bgr: np.ndarray) -> np.ndarray:
+    b,g,r = cv2.split(img_bgr.astype(np.float32))
+    mb, mg, mr = [np.mean(x) + 1e-6 for x in (b,g,r)]
+    avg = (mb + mg + mr) / 3.0
+    b *= (avg/mb); g *= (avg/mg); r *= (avg/mr)
+    return np.clip(cv2.merge((b,g,r)),0,255).astype(np.uint8)
+
+def de_yellow_lab(img_bgr: np.ndarray, strength=1.0, lab: Optional[np.ndarray] = None) -> np.ndarray:
+    """Shift Lab b* so its mean is 0 (times strength); `lab` may be a precomputed conversion."""
+    lab = lab if lab is not None else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB)
+    L,a,b = cv2.split(lab)
+    hist = plane_hist(b)
+    shift = float(np.dot(hist, (_U8 - 128.0).astype(np.float64))) / float(hist.sum()) * strength
+    b = cv2.LUT(b, np.clip(_U8 - shift, 0, 255).astype(np.uint8))
+    return cv2.cvtColor(cv2.merge((L,a,b)), cv2.COLOR_LAB2BGR)
+
+def boost_saturation(img_bgr: np.ndarray, factor=1.10, hsv: Optional[np.ndarray] = None) -> np.ndarray:
+    hsv = hsv if hsv is not None else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    h,s,v = cv2.split(hsv)
+    s = cv2.LUT(s, np.uint8(np.clip(_U8 * factor, 0, 255)))
+    return cv2.cvtColor(cv2.merge((h,s,v)), cv2.COLOR_HSV2BGR)
+
+def to_gray(img_bgr: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+
+def gray_to_bgr(gray: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+def apply_clahe(gray: np.ndarray, clip=2.2, tile=(8,8)) -> np.ndarray:
+    clahe = cv2.createCLAHE(clipLimit=float(clip), tileGridSize=tuple(map(int, tile)))
+    return clahe.apply(gray)
+
+def unsharp_mask(gray: np.ndarray, amount=0.5, radius=1.2) -> np.ndarray:
+    if amount <= 0: return gray
+    blur = cv2.GaussianBlur(gray, (0,0), radius)
+    sharp = cv2.addWeighted(gray, 1.0 + amount, blur, -amount, 0)
+    return np.clip(sharp, 0, 255).astype(np.uint8)
+
+def fast_denoise(gray: np.ndarray, strength=0.0) -> np.ndarray:
+    if strength <= 0: return gray
+    h = float(strength)
+    return cv2.fastNlMeansDenoising(gray, None, h, 7, 21)
+
+def auto_levels(img: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
+    """Per-channel levels for BGR, single-plane levels for gray."""
+    return levels_per_channel(img, low_q, high_q) if img.ndim == 3 else levels_gray(img, low_q, high_q)
+
+# ---------------- Stages ----------------
+Stage = namedtuple("Stage", "key fn")
+
+WB = Stage(("wb",), gray_world_wb)
+GRAY = Stage(("gray",), to_gray)
+GRAY_BGR = Stage(("gray_bgr",), gray_to_bgr)
+
+def levels(low_q=0.01, high_q=0.99) -> Stage:
+    return Stage(("levels", low_q, high_q), lambda im: auto_levels(im, low_q, high_q))
+
+def clahe(clip=2.2, tile=(8,8)) -> Stage:
+    return Stage(("clahe", float(clip), tuple(map(int, tile))), lambda im: apply_clahe(im, clip, tile))
+
+def de_yellow(strength=1.0) -> Stage:
+    return Stage(("de_yellow", strength), lambda im: de_yellow_lab(im, strength))
+
+def saturation(factor=1.10) -> Stage:
+    return Stage(("saturation", factor), lambda im: boost_saturation(im, factor))
+
+def unsharp(amount=0.5, radius=1.2) -> Stage:
+    return Stage(("unsharp", amount, radius), lambda im: unsharp_mask(im, amount, radius))
+
+def denoise(strength=0.0) -> Stage:
+    return Stage(("denoise", strength), lambda im: fast_denoise(im, strength))
+
+def run_chain(img: np.ndarray, chain: Sequence[Stage]) -> np.ndarray:
+    for st in chain:
+        img = st.fn(img)
+    return img
+
+class StageCache:
+    """Applies stage chains to one decoded image, sharing common prefixes.
+
+    Only prefixes used by at least two chains of `plan` are kept, so a single
+    chain frees its intermediates as it goes (no plan = nothing retained).
+    """
+    def __init__(self, img: np.ndarray, plan: Iterable[Sequence[Stage]] = ()):
+        self.img = img
+        counts = {}
+        for chain in {tuple(s.key for s in c) for c in plan}:
+            for i in range(1, len(chain) + 1):
+                counts[chain[:i]] = counts.get(chain[:i], 0) + 1
+        self._share = {k for k, n in counts.items() if n > 1}
+        self._memo = {(): img}
+
+    def run(self, chain: Sequence[Stage]) -> np.ndarray:
+        keys = tuple(s.key for s in chain)
+        n = len(keys)
+        while keys[:n] not in self._memo:
+            n -= 1
+        out = self._memo[keys[:n]]
+        for i in range(n, len(chain)):
+            out = chain[i].fn(out)
+            if keys[:i + 1] in self._share:
+                self._memo[keys[:i + 1]] = out
+        return out
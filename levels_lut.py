@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+levels_lut.py — Shared histogram/LUT auto-levels engine for the correctors.
+
+The inputs are uint8, so the quantiles np.quantile used to find by sorting every
+pixel come straight from a 256-bin histogram, and the stretch is applied with
+cv2.LUT instead of float32 maths over the whole frame. Output matches the old
+float path within +-1 level (float rounding of the quantiles).
+
+    from levels_lut import levels_per_channel, levels_gray
+    out = levels_per_channel(img_bgr, 0.01, 0.99)
+    g = levels_gray(gray, 0.01, 0.99)
+"""
+
+from typing import Optional
+import numpy as np
+import cv2
+
+_U8 = np.arange(256, dtype=np.float32)
+
+def hist_quantile(counts: np.ndarray, values: np.ndarray, q: float) -> float:
+    """np.quantile (linear interpolation) of the sample described by a histogram.
+
+    `values[i]` is the sample value of bin i and `counts[i]` its multiplicity;
+    values need not be sorted (e.g. chroma over a 2-D a/b histogram).
+    """
+    order = np.argsort(values, kind="stable")
+    v = values[order]; cum = np.cumsum(counts[order])
+    n = int(cum[-1]); pos = q * (n - 1)
+    k = int(np.floor(pos)); t = pos - k
+    lo = v[np.searchsorted(cum, k, side="right")]
+    if t == 0 or k + 1 >= n: return float(lo)
+    hi = v[np.searchsorted(cum, k + 1, side="right")]
+    return float(lo + (hi - lo) * t)
+
+def plane_hist(plane: np.ndarray, strip_rows: int = 512) -> np.ndarray:
+    """256-bin int64 histogram of a uint8 plane (strip-wise: bounded temporaries, exact counts)."""
+    hist = np.zeros(256, np.int64)
+    for y in range(0, plane.shape[0], strip_rows):
+        hist += np.bincount(plane[y:y + strip_rows].ravel(), minlength=256)
+    return hist
+
+def levels_lut(hist: np.ndarray, low_q=0.01, high_q=0.99) -> Optional[np.ndarray]:
+    """Stretch LUT mapping the low_q/high_q quantiles to 0/255; None if the plane is flat."""
+    lo = hist_quantile(hist, _U8, low_q); hi = hist_quantile(hist, _U8, high_q)
+    if hi <= lo + 1e-6: return None
+    return np.clip((_U8 - lo) * (255.0/(hi - lo)), 0, 255).astype(np.uint8)
+
+def levels_per_channel(img_bgr: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
+    """Per-channel auto-levels of a 3-channel uint8 image."""
+    luts = []
+    for c in range(3):
+        lut = levels_lut(plane_hist(img_bgr[:, :, c]), low_q, high_q)
+        luts.append(np.arange(256, dtype=np.uint8) if lut is None else lut)
+    return cv2.LUT(img_bgr, np.stack(luts, axis=-1).reshape(256, 1, 3))
+
+def levels_gray(gray: np.ndarray, low_q=0.01, high_q=0.99) -> np.ndarray:
+    """Auto-levels of a single uint8 plane."""
+    lut = levels_lut(plane_hist(gray), low_q, high_q)
+    return gray.copy() if lut is None else cv2.LUT(gray, lut)
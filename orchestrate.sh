@@ -3,19 +3,32 @@ set -euo pipefail
 
 RESTORE_VENV="./venv-photofix-restore"
 DIFFUSE_VENV="./venv-photofix-diffuse"
-INP="${1:?usage: ./orchestrate.sh path/to/photo.jpg}"
+INP="${1:?usage: ./orchestrate.sh path/to/photo.jpg|path/to/folder [outdir]}"
 OUTDIR="${2:-outputs}"
 
+# One restore process for all photos (models load once); a folder gives OUTDIR/<stem>/ per photo.
+# Photos that fail to restore are skipped; the rest are still colorized, but the script exits non-zero.
 source "$RESTORE_VENV/bin/activate"
-python scripts/restore_generate.py "$INP" "$OUTDIR"
+STATUS=0
+OUT=$(python scripts/restore_generate.py "$INP" "$OUTDIR") || STATUS=$?
 deactivate
+DIRS=()
+while IFS= read -r d; do [ -n "$d" ] && DIRS+=("$d"); done <<< "$OUT"
+[ ${#DIRS[@]} -gt 0 ] || { echo "restore_generate.py produced no output" >&2; exit 1; }
 
-source "$DIFFUSE_VENV/bin/activate"
-python scripts/diffuse_colorize.py "$OUTDIR/01_upscaled.png" "$OUTDIR"
-deactivate
+for D in "${DIRS[@]}"; do
+  source "$DIFFUSE_VENV/bin/activate"
+  python scripts/diffuse_colorize.py "$D/01_upscaled.png" "$D"
+  deactivate
 
-source "$RESTORE_VENV/bin/activate"
-python scripts/contact_sheet.py "$OUTDIR" "$OUTDIR/contact_sheet.jpg"
-deactivate
+  source "$RESTORE_VENV/bin/activate"
+  python scripts/contact_sheet.py "$D" "$D/contact_sheet.jpg"
+  deactivate
+
+  echo "Done -> $D/contact_sheet.jpg"
+done
 
-echo "Done -> $OUTDIR/contact_sheet.jpg"
+if [ "$STATUS" -ne 0 ]; then
+  echo "restore_generate.py failed for some photo(s) (exit $STATUS); see the errors above" >&2
+  exit "$STATUS"
+fi
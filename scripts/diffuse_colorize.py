@@ -1,4 +1,6 @@
+import argparse
 import sys
+import time
 from pathlib import Path
 
 import cv2
@@ -8,8 +10,26 @@ import torch
 from diffusers import StableDiffusionControlNetImg2ImgPipeline, ControlNetModel
 
 
-src = Path(sys.argv[1]).resolve()
-outdir = Path(sys.argv[2] if len(sys.argv) > 2 else "outputs").resolve()
+parser = argparse.ArgumentParser(description="ControlNet img2img colorization, one variant per seed.")
+parser.add_argument("image", help="Source image (e.g. 01_upscaled.png)")
+parser.add_argument("outdir", nargs="?", default="outputs", help="Output folder (default: outputs)")
+parser.add_argument(
+    "--seeds",
+    type=int,
+    nargs="+",
+    default=[7, 21, 42],
+    help="One variant per seed (default: 7 21 42)",
+)
+parser.add_argument(
+    "--batch",
+    type=int,
+    default=0,
+    help="Seeds per pipeline call (0 = all at once; lower it if memory runs out)",
+)
+args = parser.parse_args()
+
+src = Path(args.image).resolve()
+outdir = Path(args.outdir).resolve()
 outdir.mkdir(parents=True, exist_ok=True)
 
 
@@ -29,16 +49,23 @@ def cv_to_pil(img: np.ndarray) -> Image.Image:
     return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
 
 
-def lock_luminance(orig_rgb_pil: Image.Image, colored_rgb_pil: Image.Image) -> Image.Image:
-    orig_cv = pil_to_cv(orig_rgb_pil)
-    colored_cv = pil_to_cv(colored_rgb_pil)
+def lock_luminance(orig_rgb_pil: Image.Image, colored_rgb_pils: list) -> list:
+    """Every colored variant with the original's Lab lightness; the batch is converted as one tall image."""
+    orig_l = cv2.cvtColor(np.array(orig_rgb_pil), cv2.COLOR_RGB2Lab)[..., 0]
+    colored = np.stack([np.array(im) for im in colored_rgb_pils])
+    n, h, w, _ = colored.shape
+
+    colored_lab = cv2.cvtColor(colored.reshape(n * h, w, 3), cv2.COLOR_RGB2Lab).reshape(n, h, w, 3)
+    colored_lab[..., 0] = orig_l
+    fused = cv2.cvtColor(colored_lab.reshape(n * h, w, 3), cv2.COLOR_Lab2RGB).reshape(n, h, w, 3)
+    return [Image.fromarray(im) for im in fused]
 
-    orig_lab = cv2.cvtColor(orig_cv, cv2.COLOR_BGR2Lab)
-    colored_lab = cv2.cvtColor(colored_cv, cv2.COLOR_BGR2Lab)
 
-    colored_lab[..., 0] = orig_lab[..., 0]
-    fused_bgr = cv2.cvtColor(colored_lab, cv2.COLOR_Lab2BGR)
-    return cv_to_pil(fused_bgr)
+@torch.no_grad()
+def encode_init(pipe, image: Image.Image) -> torch.Tensor:
+    """Scaled VAE latent of `image` (posterior mean), so every seed starts from the same encode."""
+    pixels = pipe.image_processor.preprocess(image).to(device=pipe.device, dtype=pipe.vae.dtype)
+    return pipe.vae.encode(pixels).latent_dist.mode() * pipe.vae.config.scaling_factor
 
 
 device = "mps" if torch.backends.mps.is_available() else "cpu"
@@ -72,22 +99,33 @@ negative_prompt = (
     "blurry, extra limbs, deformed face, cartoon, painterly, plastic skin, makeup, artifacts, distortion, overprocessed"
 )
 
-seeds = [7, 21, 42]
-for seed in seeds:
-    generator = torch.Generator(device="cpu").manual_seed(seed)
+# The prompt, the Canny conditioning and the init latent are shared by all seeds:
+# one call per batch, with a generator per seed for the noise.
+t0 = time.perf_counter()
+init_latent = encode_init(pipe, base)
+print(f"encode: {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+seeds = args.seeds
+step = args.batch if args.batch > 0 else len(seeds)
+for i in range(0, len(seeds), step):
+    chunk = seeds[i:i + step]
+    t0 = time.perf_counter()
     result = pipe(
         prompt=prompt,
         negative_prompt=negative_prompt,
-        image=base,
+        image=init_latent.repeat(len(chunk), 1, 1, 1),
         control_image=conditioning,
         controlnet_conditioning_scale=1.2,
         strength=0.22,
         guidance_scale=5.0,
         num_inference_steps=28,
-        generator=generator,
+        num_images_per_prompt=len(chunk),
+        generator=[torch.Generator(device="cpu").manual_seed(seed) for seed in chunk],
     )
-    colored = result.images[0].convert("RGB")
-    fused = lock_luminance(base, colored)
-    fused.save(outdir / f"10_sd_seed{seed}.png")
+    fused = lock_luminance(base, [im.convert("RGB") for im in result.images])
+    for seed, im in zip(chunk, fused):
+        im.save(outdir / f"10_sd_seed{seed}.png")
+    wall = time.perf_counter() - t0
+    print(f"seeds {chunk}: {wall:.1f}s = {wall / len(chunk):.1f}s per variant", file=sys.stderr)
 
 print(str(outdir))
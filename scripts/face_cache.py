@@ -0,0 +1,127 @@
+"""Face detection done once per image, shared by GFPGAN and CodeFormer.
+
+GFPGANer.enhance() runs RetinaFace + 5-point alignment on every call, so a
+second face model (or a rerun with other settings) pays for detection again,
+and images without a single face still go through the whole face stage.
+Here detection is split from restoration:
+
+    helper = make_helper(upscale=2)                    # or GFPGANer(...).face_helper
+    faces = load_or_detect(helper, img, outdir/"faces.npz")
+    if len(faces["crops"]):
+        restored = [net(crop) for crop in faces["crops"]]    # GFPGANFaces / CodeFormerFaces
+        out = paste(helper, img, faces, restored, upscaled)
+
+faces.npz holds the boxes (x0, y0, x1, y1, score), 5-point landmarks, the
+affine matrices into the 512x512 face template and the aligned crops, keyed
+by a SHA-1 of the decoded pixels plus the detector settings; a changed image
+or setting is detected again. Detection matches GFPGANer.enhance() (all faces,
+eye_dist_threshold=5), so the pasted result is the same as before.
+
+CodeFormer's network is not part of pip basicsr 1.4.2: CodeFormerFaces needs
+basicsr/archs/codeformer_arch.py from a CodeFormer checkout
+(https://github.com/sczhou/CodeFormer) on PYTHONPATH, plus weights/codeformer.pth.
+"""
+import contextlib, hashlib, os, sys
+
+import cv2
+import numpy as np
+import torch
+
+FACE_SIZE = 512
+DETECT_MODEL = "retinaface_resnet50"
+EYE_DIST_THRESHOLD = 5   # px; smaller = side-on or tiny faces, skipped as GFPGANer does
+CODEFORMER_PATH = "weights/codeformer.pth"
+
+
+def make_helper(upscale=2, device=None):
+    """The FaceRestoreHelper GFPGANer builds, for runs that don't load GFPGAN."""
+    from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return FaceRestoreHelper(upscale, face_size=FACE_SIZE, crop_ratio=(1, 1), det_model=DETECT_MODEL,
+                             save_ext="png", use_parse=True, device=device, model_rootpath="gfpgan/weights")
+
+
+def cache_key(img):
+    h = hashlib.sha1(np.ascontiguousarray(img).data)
+    h.update(f"{img.shape}|{DETECT_MODEL}|{EYE_DIST_THRESHOLD}|{FACE_SIZE}".encode())
+    return h.hexdigest()
+
+
+def detect(helper, img):
+    """Boxes, landmarks, affine matrices and aligned crops of every face in `img` (BGR uint8)."""
+    helper.clean_all()
+    helper.read_image(img)
+    helper.get_face_landmarks_5(only_center_face=False, eye_dist_threshold=EYE_DIST_THRESHOLD)
+    helper.align_warp_face()
+    n = len(helper.cropped_faces)
+    return {
+        "boxes": np.asarray(helper.det_faces, np.float32).reshape(n, 5),
+        "landmarks": np.asarray(helper.all_landmarks_5, np.float32).reshape(n, 5, 2),
+        "affine": np.asarray(helper.affine_matrices, np.float64).reshape(n, 2, 3),
+        "crops": np.asarray(helper.cropped_faces, np.uint8).reshape(n, FACE_SIZE, FACE_SIZE, 3),
+    }
+
+
+def load_or_detect(helper, img, path):
+    """detect() result from `path` if it was made for these pixels, else detect and save it there."""
+    key = cache_key(img)
+    try:
+        with np.load(path) as z:
+            if str(z["key"]) == key:
+                return {k: z[k] for k in ("boxes", "landmarks", "affine", "crops")}
+    except (OSError, KeyError, ValueError):
+        pass
+    faces = detect(helper, img)
+    tmp = f"{path}.part"
+    with open(tmp, "wb") as f:
+        np.savez(f, key=key, **faces)
+    os.replace(tmp, path)
+    return faces
+
+
+def paste(helper, img, faces, restored, bg):
+    """Blend the `restored` 512x512 faces back into `bg` (the upscaled `img`) along the cached affines."""
+    helper.clean_all()
+    helper.read_image(img)
+    helper.affine_matrices = list(faces["affine"])
+    for face in restored:
+        helper.add_restored_face(face)
+    helper.get_inverse_affine(None)
+    return helper.paste_faces_to_input_image(upsample_img=bg)
+
+
+class GFPGANFaces:
+    """Aligned crop -> GFPGAN-restored crop, via GFPGANer's own has_aligned path."""
+    def __init__(self, restorer):
+        self.restorer = restorer
+
+    def __call__(self, crop):
+        # GFPGANer prints its inference failures; keep them off stdout, which lists output folders
+        with contextlib.redirect_stdout(sys.stderr):
+            _, restored, _ = self.restorer.enhance(crop, has_aligned=True, paste_back=False)
+        return restored[0]
+
+
+class CodeFormerFaces:
+    """Aligned crop -> CodeFormer-restored crop; `weight` trades quality (0) for fidelity (1)."""
+    def __init__(self, model_path=CODEFORMER_PATH, weight=0.5, device=None):
+        try:
+            from basicsr.archs.codeformer_arch import CodeFormer
+        except ImportError:
+            raise SystemExit("CodeFormer's arch is not in pip basicsr 1.4.2: put a CodeFormer checkout "
+                             "(https://github.com/sczhou/CodeFormer) on PYTHONPATH")
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.weight = weight
+        net = CodeFormer(dim_embd=512, codebook_size=1024, n_head=8, n_layers=9,
+                         connect_list=["32", "64", "128", "256"])
+        net.load_state_dict(torch.load(model_path, map_location="cpu")["params_ema"])
+        self.net = net.eval().to(self.device)
+
+    @torch.no_grad()
+    def __call__(self, crop):
+        from basicsr.utils import img2tensor, tensor2img
+        from torchvision.transforms.functional import normalize
+        t = img2tensor(crop / 255., bgr2rgb=True, float32=True)
+        normalize(t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+        out = self.net(t.unsqueeze(0).to(self.device), w=self.weight, adain=True)[0]
+        return tensor2img(out.squeeze(0), rgb2bgr=True, min_max=(-1, 1)).astype(np.uint8)
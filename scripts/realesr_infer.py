@@ -0,0 +1,408 @@
+"""Tiled Real-ESRGAN inference with feathered overlaps and a memory budget.
+
+TiledUpscaler wraps the network a RealESRGANer already loaded and exposes the
+same enhance(img, outscale) -> (output, None) call, so it drops in wherever
+RealESRGANer.enhance is used:
+
+    ups = RealESRGANer(scale=4, model_path=..., model=SRVGGNetCompact(...), tile=0)
+    tiled = TiledUpscaler.from_realesrganer(ups, memory_budget_mb=2048, workers=4)
+    out, _ = tiled.enhance(img, outscale=2)
+
+The tile size comes from the budget: each tile in flight costs about
+BYTES_PER_PX per input pixel (SRVGGNetCompact activations + x4 output). Tiles
+of one row band run on `workers` threads (torch drops the GIL in its kernels),
+each tile overlaps its neighbours by `overlap` px and the overlaps are blended
+with linear ramps that sum to 1, so no seams show. Bands are blended and
+written out one at a time: besides the result, only one band is held as float.
+An image that fits the budget in one tile gives exactly RealESRGANer's tile=0
+output.
+
+enhance_batch() is the other way round, for many small images (album crops):
+images whose padded size falls in the same bucket run as one batch tensor.
+
+    outs = tiled.enhance_batch([crop1, crop2, ...], outscale=2, max_batch=8)
+
+Benchmark it against production RealESRGANer.enhance(), one crop at a time:
+
+    python scripts/realesr_infer.py bench path/to/crops --batch 8
+
+OrtUpscaler runs the same network through ONNX Runtime instead of eager
+PyTorch (tiling and batching unchanged). Export it once, optionally with an
+int8 copy calibrated on our own crops; both are checked against PyTorch by
+PSNR, then compare latency side by side (needs onnx + onnxruntime):
+
+    python scripts/realesr_infer.py export --calib path/to/crops --int8
+    python scripts/realesr_infer.py compare path/to/crops
+"""
+import argparse, copy, math, os, resource, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+BYTES_PER_PX = 2048   # per input pixel of a tile in flight: ~3 live 64-ch fp32 maps + x4 output/conversions
+MIN_TILE = 64
+ONNX_PATH = "weights/realesr-general-x4v3.onnx"
+ONNX_INT8_PATH = "weights/realesr-general-x4v3.int8.onnx"
+MIN_PSNR_FP32 = 45.0   # dB vs PyTorch; an fp32 export is only rounding away
+
+
+def peak_rss_mb(children=False):
+    """Peak resident set size of this process (or its largest finished child) so far, in MB."""
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024.0   # bytes on macOS, KB on Linux
+
+
+def tile_for_budget(h, w, memory_budget_mb, workers=1, overlap=16):
+    """Core tile size (px) so `workers` tiles in flight fit the budget; 0 = whole image in one go."""
+    if memory_budget_mb <= 0:
+        return 0
+    max_px = memory_budget_mb * (1 << 20) / (BYTES_PER_PX * max(1, workers))
+    if h * w <= max_px:
+        return 0
+    return max(MIN_TILE, 2 * overlap, int(math.sqrt(max_px)) - 2 * overlap)
+
+
+def feather(o0, o1, scale, start, end, size, overlap):
+    """Weights of output pixels [o0, o1) of a tile whose core is input [start, end).
+
+    Linear ramps across [start - overlap, start + overlap) and [end - overlap,
+    end + overlap) (none at the image border); a neighbour's ramp is the
+    complement, so overlapping weights sum to 1.
+    """
+    x = (np.arange(o0, o1, dtype=np.float32) + 0.5) / scale   # input coord of each output pixel centre
+    w = np.ones(o1 - o0, np.float32)
+    if start > 0:
+        w = np.minimum(w, np.clip((x - (start - overlap)) / (2.0 * overlap), 0, 1))
+    if end < size:
+        w = np.minimum(w, np.clip(((end + overlap) - x) / (2.0 * overlap), 0, 1))
+    return w
+
+
+def psnr(a, b):
+    """PSNR (dB) between two uint8 images; inf if identical."""
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10.0 * math.log10(255.0 ** 2 / mse)
+
+
+def to_input(batch_bgr):
+    """(N, H, W, 3) uint8 BGR -> (N, 3, H, W) float32 RGB in [0, 1], the network's input layout."""
+    return np.ascontiguousarray(batch_bgr[..., ::-1].transpose(0, 3, 1, 2)).astype(np.float32) / 255.0
+
+
+def pad_to(img, hb, wb):
+    """Reflect-pad right/bottom to (hb, wb); replicate for 1-px edges, which can't reflect."""
+    h, w = img.shape[:2]
+    if (h, w) == (hb, wb):
+        return img
+    mode = cv2.BORDER_REFLECT_101 if min(h, w) > 1 else cv2.BORDER_REPLICATE
+    return cv2.copyMakeBorder(img, 0, hb - h, 0, wb - w, mode)
+
+
+class TiledUpscaler:
+    def __init__(self, model, scale=4, device=None, half=False, memory_budget_mb=0, workers=1, overlap=16):
+        self.model, self.scale = model, scale
+        self.device = device or torch.device("cpu")
+        self.half = half
+        self.memory_budget_mb, self.workers, self.overlap = memory_budget_mb, max(1, workers), overlap
+
+    @classmethod
+    def from_realesrganer(cls, ups, **kw):
+        return cls(ups.model, scale=ups.scale, device=ups.device, half=ups.half, **kw)
+
+    @torch.no_grad()
+    def _forward(self, batch_bgr):
+        """(N, H, W, 3) uint8 BGR -> (N, 3, H*scale, W*scale) float RGB in [0, 1], as numpy."""
+        t = torch.from_numpy(to_input(batch_bgr)).to(self.device)
+        if self.half:
+            t = t.half()
+        return self.model(t).data.float().cpu().clamp_(0, 1).numpy()
+
+    @staticmethod
+    def _to_bgr8(out_rgb):
+        """One (3, H, W) network output -> uint8 BGR, rounded like RealESRGANer."""
+        return (np.transpose(out_rgb[[2, 1, 0], :, :], (1, 2, 0)) * 255.0).round().astype(np.uint8)
+
+    def _infer(self, tile_bgr):
+        """Network output for one uint8 BGR tile, as uint8 BGR at x`scale` (RealESRGANer's conversion)."""
+        return self._to_bgr8(self._forward(tile_bgr[None])[0])
+
+    def enhance_batch(self, imgs, outscale=None, max_batch=8, bucket=64):
+        """enhance() for a list of small images, run as padded micro-batches; returns the outputs in order.
+
+        Images are grouped by size rounded up to `bucket` px, reflect-padded on
+        the right/bottom to it and run `max_batch` at a time (fewer if the
+        memory budget says so); each output is cropped back before conversion.
+        Only pixels within the network's reach of the padded edges can differ
+        from enhance() (RealESRGANer pads the same way with pre_pad).
+        """
+        outscale = outscale or self.scale
+        groups = {}
+        for i, im in enumerate(imgs):
+            h, w = im.shape[:2]
+            groups.setdefault((-(-h // bucket) * bucket, -(-w // bucket) * bucket), []).append(i)
+        outs = [None] * len(imgs)
+        for (hb, wb), idx in groups.items():
+            n = max(1, max_batch)
+            if self.memory_budget_mb > 0:
+                n = max(1, min(n, int(self.memory_budget_mb * (1 << 20) // (BYTES_PER_PX * hb * wb))))
+            for k in range(0, len(idx), n):
+                chunk = idx[k:k + n]
+                batch = np.stack([pad_to(imgs[i], hb, wb) for i in chunk])
+                res = self._forward(batch)
+                for j, i in enumerate(chunk):
+                    h, w = imgs[i].shape[:2]
+                    out = self._to_bgr8(res[j, :, :h * self.scale, :w * self.scale])
+                    if outscale != self.scale:
+                        out = cv2.resize(out, (int(w * outscale), int(h * outscale)), interpolation=cv2.INTER_LANCZOS4)
+                    outs[i] = out
+        return outs
+
+    def enhance(self, img, outscale=None):
+        outscale = outscale or self.scale
+        h, w = img.shape[:2]
+        W, H = int(w * outscale), int(h * outscale)
+        tile = tile_for_budget(h, w, self.memory_budget_mb, self.workers, self.overlap)
+        if tile == 0:
+            out = self._infer(img)
+            if outscale != self.scale:
+                out = cv2.resize(out, (W, H), interpolation=cv2.INTER_LANCZOS4)
+            return out, None
+
+        ov = self.overlap
+        xs = list(range(0, w, tile)); ys = list(range(0, h, tile))
+        to_out = lambda v, n: min(n, int(round(v * outscale)))
+        result = np.empty((H, W, 3), np.uint8)
+        carry = None     # weighted float rows still waiting for the next band's share
+
+        def run(y0, y1, ya, yb, x0, x1):
+            xa, xb = max(0, x0 - ov), min(w, x1 + ov)
+            up = self._infer(img[ya:yb, xa:xb])
+            oy0, oy1, ox0, ox1 = to_out(ya, H), to_out(yb, H), to_out(xa, W), to_out(xb, W)
+            if up.shape[:2] != (oy1 - oy0, ox1 - ox0):
+                up = cv2.resize(up, (ox1 - ox0, oy1 - oy0), interpolation=cv2.INTER_LANCZOS4)
+            wx = feather(ox0, ox1, outscale, x0, x1, w, ov)
+            return ox0, ox1, up.astype(np.float32) * wx[None, :, None]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for y0 in ys:
+                y1 = min(h, y0 + tile)
+                ya, yb = max(0, y0 - ov), min(h, y1 + ov)
+                oy0, oy1 = to_out(ya, H), to_out(yb, H)
+                band = np.zeros((oy1 - oy0, W, 3), np.float32)
+                for ox0, ox1, part in pool.map(lambda x0: run(y0, y1, ya, yb, x0, min(w, x0 + tile)), xs):
+                    band[:, ox0:ox1] += part
+                band *= feather(oy0, oy1, outscale, y0, y1, h, ov)[:, None, None]
+                if carry is not None:
+                    band[:carry.shape[0]] += carry
+                # Rows below the next band's top edge still get a share from it
+                done = oy1 if y1 >= h else to_out(y1 - ov, H)
+                result[oy0:done] = np.clip(band[:done - oy0] + 0.5, 0, 255).astype(np.uint8)
+                carry = band[done - oy0:]
+        return result, None
+
+
+class OrtUpscaler(TiledUpscaler):
+    """TiledUpscaler whose forward pass is an ONNX Runtime session (fp32 or int8 export)."""
+    def __init__(self, onnx_path, scale=4, threads=0, **kw):
+        import onnxruntime as ort
+        super().__init__(None, scale=scale, **kw)
+        so = ort.SessionOptions()
+        if threads:
+            so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(onnx_path), so, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, batch_bgr):
+        out = self.session.run(None, {self.input_name: to_input(batch_bgr)})[0]
+        return np.clip(out, 0, 1)
+
+
+def export_onnx(model, path, opset=17):
+    """Write `model` (the loaded SRVGGNetCompact) as ONNX with dynamic batch/height/width.
+
+    The export goes to a temp file that is renamed into place, so nobody loads
+    a half-written model and an interrupted export leaves nothing behind.
+    """
+    model = copy.deepcopy(model).cpu().float().eval()   # leave the caller's (maybe MPS/half) model alone
+    dummy = torch.rand(1, 3, 64, 64)
+    tmp = f"{path}.{os.getpid()}.part"
+    try:
+        with torch.no_grad():
+            torch.onnx.export(model, dummy, tmp, opset_version=opset, input_names=["input"], output_names=["output"],
+                              dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"},
+                                            "output": {0: "batch", 2: "height", 3: "width"}})
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def worst_psnr(ref, onnx_path, samples):
+    """Lowest PSNR (dB) of the ONNX model's output against `ref` (PyTorch) over `samples`."""
+    run = OrtUpscaler(onnx_path)
+    return min(psnr(ref.enhance(im)[0], run.enhance(im)[0]) for im in samples)
+
+
+def synthetic_samples(n=4, size=128, seed=0):
+    """Smooth random BGR images with some grain, for checks when no photos are at hand."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        base = cv2.resize(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+        out.append(np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8))
+    return out
+
+
+def ensure_onnx(ups, path=ONNX_PATH):
+    """Export the fp32 model to `path` if it is missing, keeping it only if it matches PyTorch (MIN_PSNR_FP32)."""
+    if Path(path).exists():
+        return
+    ref = TiledUpscaler.from_realesrganer(ups)
+    export_onnx(ref.model, path)
+    got = worst_psnr(ref, path, synthetic_samples())
+    if got < MIN_PSNR_FP32:
+        os.remove(path)
+        raise SystemExit(f"{path}: worst PSNR vs PyTorch {got:.2f} dB < {MIN_PSNR_FP32} dB, export discarded")
+    print(f"exported {path}: worst PSNR vs PyTorch {got:.2f} dB", file=sys.stderr)
+
+
+def calibration_crops(imgs, n=64, size=128, seed=0):
+    """n random size x size crops (smaller images whole) drawn from `imgs`, as network inputs."""
+    rng = np.random.default_rng(seed)
+    crops = []
+    for k in range(n):
+        im = imgs[k % len(imgs)]
+        h, w = im.shape[:2]
+        y = int(rng.integers(0, max(1, h - size + 1))); x = int(rng.integers(0, max(1, w - size + 1)))
+        crops.append(to_input(im[None, y:y + size, x:x + size]))
+    return crops
+
+
+def quantize_int8(fp32_path, int8_path, crops):
+    """Static int8 (QDQ, per-channel weights) quantization of the ONNX model, calibrated on `crops`."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.it = iter([{"input": c} for c in crops])
+
+        def get_next(self):
+            return next(self.it, None)
+
+    pre = str(int8_path) + ".pre.onnx"   # shape inference + graph cleanup, as ORT recommends before quantizing
+    quant_pre_process(str(fp32_path), pre, skip_symbolic_shape=True)   # H/W are dynamic
+    try:
+        quantize_static(pre, str(int8_path), Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        os.remove(pre)
+
+
+def load_images(folder, limit):
+    from restore_generate import IMAGE_EXTS, read_image
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in IMAGE_EXTS)[:limit]
+    if not paths:
+        raise SystemExit(f"no images found in {folder}")
+    return [read_image(p) for p in paths]
+
+
+def export_cmd(argv=None):
+    """Export ONNX (and optionally int8) and check each against PyTorch on the calibration crops."""
+    ap = argparse.ArgumentParser(description="Export the Real-ESRGAN upscaler to ONNX (+ int8).")
+    ap.add_argument("--calib", required=True, help="Folder of our own crops: int8 calibration + PSNR check")
+    ap.add_argument("--out", default=ONNX_PATH)
+    ap.add_argument("--int8", action="store_true", help="Also write a statically quantized int8 model")
+    ap.add_argument("--int8-out", default=ONNX_INT8_PATH)
+    ap.add_argument("--min-psnr", type=float, default=32.0, help="int8 must stay within this PSNR (dB) of PyTorch")
+    ap.add_argument("--limit", type=int, default=32, help="Calibration images to use")
+    args = ap.parse_args(argv)
+
+    from restore_generate import load_upsampler
+    ref = TiledUpscaler.from_realesrganer(load_upsampler())
+    export_onnx(ref.model, args.out)
+    imgs = load_images(args.calib, args.limit)
+    checks = [(args.out, MIN_PSNR_FP32)]
+    if args.int8:
+        quantize_int8(args.out, args.int8_out, calibration_crops(imgs))
+        checks.append((args.int8_out, args.min_psnr))
+
+    samples = [im[:256, :256] for im in imgs[:8]]
+    ok = True
+    for path, need in checks:
+        got = worst_psnr(ref, path, samples)
+        ok &= got >= need
+        print(f"{path}: worst PSNR vs PyTorch {got:.2f} dB (need >= {need:.1f}) -> {'ok' if got >= need else 'FAIL'}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def compare_cmd(argv=None):
+    """Latency per image of torch / onnx / onnx-int8 on the same crops, with PSNR vs torch."""
+    ap = argparse.ArgumentParser(description="Side-by-side latency of the upscaler backends.")
+    ap.add_argument("folder")
+    ap.add_argument("--outscale", type=float, default=2)
+    ap.add_argument("--limit", type=int, default=16)
+    ap.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = its default)")
+    args = ap.parse_args(argv)
+
+    from restore_generate import load_upsampler
+    imgs = load_images(args.folder, args.limit)
+    backends = [("torch", TiledUpscaler.from_realesrganer(load_upsampler()))]
+    for name, path in (("onnx", ONNX_PATH), ("onnx-int8", ONNX_INT8_PATH)):
+        if Path(path).exists():
+            backends.append((name, OrtUpscaler(path, threads=args.threads)))
+    ref = None
+    for name, up in backends:
+        up._infer(imgs[0][:32, :32])   # warm-up
+        t0 = time.perf_counter()
+        outs = [up.enhance(im, outscale=args.outscale)[0] for im in imgs]
+        dt = (time.perf_counter() - t0) / len(imgs)
+        ref = ref or outs
+        q = min(psnr(a, b) for a, b in zip(ref, outs))
+        print(f"{name:>10}: {dt * 1000:8.1f} ms/image, worst PSNR vs torch {q:.2f} dB")
+
+
+def bench(argv=None):
+    """Crops/s of production RealESRGANer.enhance() one by one vs enhance_batch() on a folder,
+    plus how far the outputs differ."""
+    ap = argparse.ArgumentParser(description="Benchmark micro-batched Real-ESRGAN on a folder of crops.")
+    ap.add_argument("folder")
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--bucket", type=int, default=64)
+    ap.add_argument("--outscale", type=float, default=2)
+    ap.add_argument("--limit", type=int, default=64, help="Use at most this many images")
+    args = ap.parse_args(argv)
+
+    from restore_generate import IMAGE_EXTS, load_upsampler, read_image
+    paths = sorted(p for p in Path(args.folder).iterdir() if p.suffix.lower() in IMAGE_EXTS)[:args.limit]
+    imgs = [read_image(p) for p in paths]
+    if not imgs:
+        raise SystemExit("no images found")
+    ups = load_upsampler()
+    up = TiledUpscaler.from_realesrganer(ups)
+    ups.enhance(imgs[0][:32, :32], outscale=args.outscale)   # warm-up
+    up._infer(imgs[0][:32, :32])
+
+    t0 = time.perf_counter()
+    single = [ups.enhance(im, outscale=args.outscale)[0] for im in imgs]
+    t1 = time.perf_counter()
+    batched = up.enhance_batch(imgs, outscale=args.outscale, max_batch=args.batch, bucket=args.bucket)
+    t2 = time.perf_counter()
+    diff = max(int(np.abs(a.astype(np.int16) - b).max()) for a, b in zip(single, batched))
+    print(f"{len(imgs)} crop(s): single {len(imgs) / (t1 - t0):.2f} crops/s, "
+          f"batch {args.batch} (bucket {args.bucket}) {len(imgs) / (t2 - t1):.2f} crops/s, "
+          f"x{(t1 - t0) / (t2 - t1):.2f}; max pixel diff {diff}")
+
+
+COMMANDS = {"bench": bench, "export": export_cmd, "compare": compare_cmd}
+
+if __name__ == "__main__":
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        raise SystemExit("usage: python scripts/realesr_infer.py {bench,export,compare} ... (-h for options)")
@@ -1,42 +1,350 @@
-import sys, os, cv2, numpy as np
+import sys, os, time, argparse, shutil, cv2, numpy as np
+import multiprocessing as mp
+import multiprocessing.connection
+from collections import Counter
 from pathlib import Path
+from queue import Queue, Empty
+from threading import Lock, Thread
 
+import torch
 from realesrgan import RealESRGANer
 from realesrgan.archs.srvgg_arch import SRVGGNetCompact
 from gfpgan import GFPGANer
 
-inp = Path(sys.argv[1]).resolve()
-outdir = Path(sys.argv[2] if len(sys.argv)>2 else "outputs").resolve()
-outdir.mkdir(parents=True, exist_ok=True)
-
-img = cv2.imread(str(inp), cv2.IMREAD_COLOR)
-if img is None:
-    raise FileNotFoundError(f"Unable to read input image: {inp}")
-
-realesr_model = SRVGGNetCompact(
-    num_in_ch=3,
-    num_out_ch=3,
-    num_feat=64,
-    num_conv=32,
-    upscale=4,
-    act_type='prelu'
-)
-
-ups = RealESRGANer(
-    scale=4,
-    model_path="weights/realesr-general-x4v3.pth",
-    model=realesr_model,
-    tile=0,
-    tile_pad=10,
-    pre_pad=0,
-    half=False
-)
-upscaled, _ = ups.enhance(img, outscale=2)
-cv2.imwrite(str(outdir/"01_upscaled.png"), upscaled)
-
-restorer = GFPGANer(model_path="weights/GFPGANv1.4.pth", upscale=2, arch="clean", channel_multiplier=2, bg_upsampler=ups)
-_, _, restored = restorer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
-cv2.imwrite(str(outdir/"02_gfpgan.png"), restored)
-
-cv2.imwrite(str(outdir/"00_input.png"), img)
-print(str(outdir))
+from face_cache import CodeFormerFaces, GFPGANFaces, load_or_detect, make_helper, paste
+from realesr_infer import ONNX_INT8_PATH, ONNX_PATH, OrtUpscaler, TiledUpscaler, ensure_onnx, peak_rss_mb
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+FACE_OUTPUTS = {"gfpgan": "02_gfpgan.png", "codeformer": "03_codeformer.png"}
+
+
+def load_upsampler():
+    realesr_model = SRVGGNetCompact(
+        num_in_ch=3,
+        num_out_ch=3,
+        num_feat=64,
+        num_conv=32,
+        upscale=4,
+        act_type='prelu'
+    )
+
+    ups = RealESRGANer(
+        scale=4,
+        model_path="weights/realesr-general-x4v3.pth",
+        model=realesr_model,
+        tile=0,
+        tile_pad=10,
+        pre_pad=0,
+        half=False
+    )
+    return ups
+
+
+def load_models(face_model="gfpgan", codeformer_weight=0.5):
+    """(ups, helper, restorers): the upsampler, the face helper shared by every face model, {name: crop -> crop}."""
+    ups = load_upsampler()
+    restorers = {}
+    if face_model in ("gfpgan", "both"):
+        restorer = GFPGANer(model_path="weights/GFPGANv1.4.pth", upscale=2, arch="clean", channel_multiplier=2, bg_upsampler=ups)
+        restorers["gfpgan"] = GFPGANFaces(restorer)
+        helper = restorer.face_helper
+    else:
+        helper = make_helper(upscale=2)
+    if face_model in ("codeformer", "both"):
+        restorers["codeformer"] = CodeFormerFaces(weight=codeformer_weight)
+    return ups, helper, restorers
+
+
+def read_image(path):
+    img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"Unable to read input image: {path}")
+    return img
+
+
+def restore_one(img, outdir, models, upscaler=None, upscaled=None):
+    """Write 00_input / 01_upscaled / 02_gfpgan and/or 03_codeformer for one decoded image; returns stage timings.
+
+    `models` is (ups, helper, restorers) from load_models(). Faces are detected once
+    (cached in <outdir>/faces.npz) and every face model restores the same crops;
+    with no faces the face outputs are copies of 01_upscaled.
+    `upscaler` (default: ups itself) does the x2 upscale, e.g. a TiledUpscaler;
+    `upscaled` is that x2 result when it was already computed in a batch.
+    """
+    ups, helper, restorers = models
+    outdir.mkdir(parents=True, exist_ok=True)
+    timings = {}
+    t1 = time.perf_counter()
+    if upscaled is None:
+        upscaled, _ = (upscaler or ups).enhance(img, outscale=2)
+    t2 = time.perf_counter(); timings["upscale"] = t2 - t1
+    cv2.imwrite(str(outdir/"01_upscaled.png"), upscaled)
+    t3 = time.perf_counter(); timings["write"] = t3 - t2
+
+    faces = load_or_detect(helper, img, outdir/"faces.npz")
+    t4 = time.perf_counter(); timings["detect"] = t4 - t3
+    for name, restore in restorers.items():
+        if len(faces["crops"]):
+            restored = paste(helper, img, faces, [restore(c) for c in faces["crops"]], upscaled)
+            t5 = time.perf_counter(); timings[name] = t5 - t4
+            cv2.imwrite(str(outdir/FACE_OUTPUTS[name]), restored)
+        else:
+            t5 = time.perf_counter(); timings[name] = 0.0
+            shutil.copyfile(outdir/"01_upscaled.png", outdir/FACE_OUTPUTS[name])
+        t4 = time.perf_counter(); timings["write"] += t4 - t5
+
+    cv2.imwrite(str(outdir/"00_input.png"), img)
+    timings["write"] += time.perf_counter() - t4
+    return timings
+
+
+def iter_jobs(args):
+    """(input path, output folder) pairs: one file, every image in a folder, or lines read from stdin."""
+    outroot = Path(args.outdir).resolve()
+    if args.input == "-":
+        # One path per line, optionally "<path>\t<outdir>"; default outdir = <outroot>/<stem>
+        for line in sys.stdin:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            src, _, out = line.partition("\t")
+            yield Path(src).resolve(), Path(out).resolve() if out else outroot/Path(src).stem
+    elif Path(args.input).is_dir():
+        for p in sorted(Path(args.input).iterdir()):
+            if p.is_file() and p.suffix.lower() in IMAGE_EXTS:
+                yield p.resolve(), outroot/p.stem
+    else:
+        yield Path(args.input).resolve(), outroot
+
+
+def make_upscaler(ups, args, threads):
+    kw = dict(memory_budget_mb=args.memory_budget, workers=args.tile_workers or max(1, threads // 4),
+              overlap=args.tile_overlap)
+    if args.backend == "onnx":
+        return OrtUpscaler(ONNX_PATH, scale=ups.scale, threads=threads, **kw)
+    if args.backend == "onnx-int8":
+        if not Path(ONNX_INT8_PATH).exists():
+            raise SystemExit(f"{ONNX_INT8_PATH} missing: run scripts/realesr_infer.py export --int8 --calib <crops>")
+        return OrtUpscaler(ONNX_INT8_PATH, scale=ups.scale, threads=threads, **kw)
+    if args.memory_budget <= 0 and args.batch <= 1:
+        return None
+    return TiledUpscaler.from_realesrganer(ups, **kw)
+
+
+def restore_many(items, models, upscaler, args):
+    """restore_one() over [(src, outdir, img, error)], upscaling the small images as micro-batches.
+
+    Returns [(src, outdir, timings, error)]; batched images are charged an equal
+    share of their batch's upscale time.
+    """
+    small = [i for i, (_, _, img, err) in enumerate(items) if err is None and max(img.shape[:2]) <= args.batch_max_side]
+    upscaled = {}
+    if upscaler is not None and args.batch > 1 and len(small) > 1:
+        t0 = time.perf_counter()
+        outs = upscaler.enhance_batch([items[i][2] for i in small], outscale=2, max_batch=args.batch)
+        share = (time.perf_counter() - t0) / len(small)
+        upscaled = dict(zip(small, outs))
+    done = []
+    for i, (src, outdir, img, err) in enumerate(items):
+        try:
+            if err:
+                raise err
+            timings = restore_one(img, outdir, models, upscaler, upscaled.get(i))
+            if i in upscaled:
+                timings["upscale"] = share
+            done.append((src, outdir, timings, None))
+        except Exception as e:
+            done.append((src, outdir, None, e))
+    return done
+
+
+def take(get, get_nowait, n):
+    """(items, ended): the next item (blocking) plus up to n-1 more already waiting, stopping at the None sentinel."""
+    first = get()
+    if first is None:
+        return [], True
+    items = [first]
+    while len(items) < n:
+        try:
+            nxt = get_nowait()
+        except Empty:
+            break
+        if nxt is None:
+            return items, True
+        items.append(nxt)
+    return items, False
+
+
+def run_inline(args, threads):
+    """Yield (worker, src, outdir, timings, error) per image, in this process."""
+    if args.threads_per_worker:
+        torch.set_num_threads(threads)
+    t0 = time.perf_counter()
+    models = load_models(args.face_model, args.codeformer_weight)
+    upscaler = make_upscaler(models[0], args, threads)
+    print(f"timings: load={time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+    # A reader thread decodes the next image while the current one is in inference
+    # (and waits on stdin without holding up a result the caller is waiting for).
+    queue = Queue(maxsize=max(1, args.batch))
+    def produce():
+        for src, outdir in iter_jobs(args):
+            try:
+                queue.put((src, outdir, read_image(src), None))
+            except Exception as e:
+                queue.put((src, outdir, None, e))
+        queue.put(None)
+    Thread(target=produce, daemon=True).start()
+
+    end = False
+    while not end:
+        items, end = take(queue.get, queue.get_nowait, max(1, args.batch))
+        for src, outdir, timings, err in restore_many(items, models, upscaler, args):
+            yield 0, src, outdir, timings, err
+
+
+def core_slices(workers, threads):
+    """Cores for each worker: consecutive, non-overlapping slices of `threads` (wrapping if short)."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+
+def worker_loop(wid, threads, cores, args, jobs, results):
+    """Worker process: pin to `cores`, size torch's thread pools, load the models once, drain `jobs`.
+
+    `results` is this worker's own pipe end, so a worker that dies mid-send
+    cannot leave a lock held that the others need.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)   # Linux only; elsewhere the thread counts alone keep workers apart
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(1)
+    models = load_models(args.face_model, args.codeformer_weight)
+    upscaler = make_upscaler(models[0], args, threads)
+    end = False
+    while not end:
+        batch, end = take(jobs.get, jobs.get_nowait, max(1, args.batch))
+        items = []
+        for src, outdir in batch:
+            try:
+                items.append((src, outdir, read_image(src), None))
+            except Exception as e:
+                items.append((src, outdir, None, e))
+        for src, outdir, timings, err in restore_many(items, models, upscaler, args):
+            results.send((wid, src, outdir, timings, f"{err}" if err else None))
+    results.send(wid)   # a bare worker id = that worker drained the queue and exits
+
+
+def run_workers(args, threads):
+    """Yield (worker, src, outdir, timings, error) per image from args.workers processes sharing one job queue.
+
+    Jobs a worker took but never reported (it crashed or was killed), and jobs
+    nobody was left to take, come back as errors.
+    """
+    ctx = mp.get_context("spawn")   # no forking a parent that may hold torch/OpenMP state
+    jobs = ctx.Queue(maxsize=(max(1, args.batch) + 1) * args.workers)
+    procs, conns = [], {}
+    for i, cores in enumerate(core_slices(args.workers, threads)):
+        recv, send = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=worker_loop, args=(i, threads, cores, args, jobs, send), daemon=True)
+        p.start()
+        send.close()   # the worker holds the only write end: its exit = EOF here
+        procs.append(p); conns[recv] = i
+
+    # (src, outdir) handed to the queue and not reported back yet
+    pending, lock = Counter(), Lock()
+    def feed():
+        for job in iter_jobs(args):
+            with lock:
+                pending[job] += 1
+            jobs.put(job)
+        for _ in procs:
+            jobs.put(None)
+    feeder = Thread(target=feed, daemon=True)
+    feeder.start()
+
+    while conns:
+        for conn in mp.connection.wait(list(conns)):
+            wid = conns[conn]
+            try:
+                r = conn.recv()
+            except EOFError:
+                procs[wid].join(timeout=5)
+                print(f"! worker {wid} exited early (exit code {procs[wid].exitcode})", file=sys.stderr)
+                del conns[conn]
+                continue
+            if isinstance(r, int):
+                del conns[conn]
+                continue
+            with lock:
+                pending[(r[1], r[2])] -= 1
+            yield r
+    # No worker left: let the feeder finish so every remaining job is counted
+    while feeder.is_alive():
+        try:
+            jobs.get(timeout=1)
+        except Empty:
+            pass
+    for (src, outdir), n in pending.items():
+        for _ in range(n):
+            yield None, src, outdir, None, "not restored: its worker exited early"
+    for p in procs:
+        p.join(timeout=5)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Real-ESRGAN upscale + GFPGAN/CodeFormer face restore; models load once per run.")
+    ap.add_argument("input", help="Image, folder of images (-> <outdir>/<stem>/), or - to read paths from stdin")
+    ap.add_argument("outdir", nargs="?", default="outputs", help="Output folder (default: outputs)")
+    ap.add_argument("--memory-budget", type=int, default=0,
+                    help="MB for Real-ESRGAN activations; larger images run in feathered tiles (0 = whole image)")
+    ap.add_argument("--tile-workers", type=int, default=0,
+                    help="Tiles upscaled in parallel, sharing the budget (0 = one per 4 torch threads)")
+    ap.add_argument("--tile-overlap", type=int, default=16, help="Overlap between tiles, px of input")
+    ap.add_argument("--batch", type=int, default=1,
+                    help="Upscale up to this many waiting images as padded micro-batches (small album crops)")
+    ap.add_argument("--batch-max-side", type=int, default=1024, help="Only images up to this size are batched")
+    ap.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"],
+                    help="Real-ESRGAN runtime: eager PyTorch fp32, or ONNX Runtime fp32/int8 (CPU)")
+    ap.add_argument("--face-model", default="gfpgan", choices=["gfpgan", "codeformer", "both"],
+                    help="Face restorer(s): 02_gfpgan.png and/or 03_codeformer.png; faces are detected once and cached")
+    ap.add_argument("--codeformer-weight", type=float, default=0.5,
+                    help="CodeFormer fidelity: 0 = strongest restoration, 1 = closest to the input face")
+    ap.add_argument("--workers", type=int, default=1, help="Restore processes sharing one job queue (folder/stdin input)")
+    ap.add_argument("--threads-per-worker", type=int, default=0, help="torch threads per worker (0 = cores / workers)")
+    args = ap.parse_args()
+
+    cpus = os.cpu_count() or 1
+    threads = args.threads_per_worker or max(1, cpus // args.workers)
+
+    if args.backend == "onnx" and not Path(ONNX_PATH).exists():
+        ensure_onnx(load_upsampler())   # one-off export + PSNR check, here so workers never race to write it
+
+    single = args.input != "-" and not Path(args.input).is_dir()
+    failed = done = 0
+    t0 = time.perf_counter()
+    for wid, src, outdir, timings, err in (run_workers if args.workers > 1 else run_inline)(args, threads):
+        if err:
+            if single:
+                raise err if isinstance(err, Exception) else RuntimeError(err)
+            failed += 1
+            print(f"! {src}: {err}", file=sys.stderr)
+            continue
+        done += 1
+        tag = f" [w{wid}]" if args.workers > 1 else ""
+        print(f"timings {src.name}{tag}: " + " ".join(f"{k}={v:.2f}s" for k, v in timings.items()), file=sys.stderr)
+        print(str(outdir), flush=True)
+    wall = time.perf_counter() - t0
+    print(f"{done} image(s) in {wall:.1f}s = {60.0 * done / wall:.1f} images/min "
+          f"({args.workers} worker(s) x {threads} thread(s))", file=sys.stderr)
+    if args.workers > 1:
+        print(f"peak RSS: {peak_rss_mb():.0f} MB parent, {peak_rss_mb(children=True):.0f} MB largest worker", file=sys.stderr)
+    else:
+        print(f"peak RSS: {peak_rss_mb():.0f} MB", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,9 @@ pip install numpy==1.26.4 opencv-python pillow tqdm
 # Restoration libs
 pip install basicsr==1.4.2 facexlib==0.3.0 realesrgan==0.3.0 gfpgan==1.3.8
 
+# CPU backend for the upscaler (restore_generate.py --backend onnx / onnx-int8)
+pip install onnx==1.16.2 onnxruntime==1.19.2
+
 # TorchVision 0.20 dropped functional_tensor — provide a compatibility shim for basicsr
 python - <<'PY'
 from pathlib import Path
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+skip_cache.py — Incremental-run manifest for the batch scripts.
+
+A JSON manifest in the output root remembers, for every source file, its size,
+mtime and SHA-1, a hash of the effective parameters, the outputs it produced and
+(optionally) its log record. On the next run a file is skipped when:
+  - the parameter hash matches, and
+  - the outputs asked for were all recorded, and every recorded output still exists, and
+  - size+mtime match (fast path) or, if only the mtime moved, the SHA-1 matches.
+
+    man = SkipManifest(out_root, "auto_correct_photos", effective_params(args))
+    rec = man.check(src, [dst])       # None -> (re)process
+    ...
+    man.record(src, [dst, preview], log_record)
+    man.save()
+
+record() hashes on a thread pool (hashlib and file reads release the GIL), so a
+--jobs run does not queue every source behind one SHA-1 in the parent; save()
+waits for the pending hashes. A source whose size+mtime did not move since its
+last record keeps the stored SHA-1 and is not read again.
+"""
+
+import os, json, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Options that only choose WHAT to process or HOW FAST, never what an output looks like.
+NON_EFFECTIVE = ("input", "out", "recursive", "extensions", "jobs", "force")
+
+def effective_params(args, ignore=()) -> Dict:
+    return {k: v for k, v in sorted(vars(args).items()) if k not in NON_EFFECTIVE and k not in ignore}
+
+def params_hash(params: Dict) -> str:
+    blob = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()
+
+def file_sha1(path: str, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(bufsize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class SkipManifest:
+    """Per-output-root record of which inputs were processed with which parameters."""
+
+    VERSION = 1
+
+    def __init__(self, out_root: str, name: str, params: Dict, enabled: bool = True, autosave: int = 25):
+        self.path = os.path.join(out_root, f".{name}.manifest.json")
+        self.key = params_hash(params)
+        self.enabled = enabled
+        self.autosave = autosave
+        self._dirty = 0
+        self._hasher: Optional[ThreadPoolExecutor] = None
+        self._hashing: Dict[str, object] = {}
+        self.entries: Dict[str, Dict] = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data.get("entries", {})
+            except (OSError, ValueError):
+                self.entries = {}  # corrupt/partial manifest: just rebuild it
+
+    def check(self, src: str, outputs: List[str]) -> Optional[Dict]:
+        """Stored entry if `src` is unchanged and already processed with these params, else None."""
+        if not self.enabled:
+            return None
+        e = self.entries.get(os.path.abspath(src))
+        if not e or e.get("params") != self.key or not set(outputs) <= set(e.get("outputs", [])):
+            return None
+        if not all(os.path.exists(o) for o in e["outputs"]):
+            return None
+        try:
+            st = os.stat(src)
+        except OSError:
+            return None
+        if st.st_size != e.get("size"):
+            return None
+        if st.st_mtime_ns != e.get("mtime_ns"):
+            # Touched (copied, re-synced from the NAS...) but maybe not changed: compare content.
+            if e.get("sha1") is None or file_sha1(src) != e["sha1"]:
+                return None
+            e["mtime_ns"] = st.st_mtime_ns; self._touch()
+        return e
+
+    def record(self, src: str, outputs: List[str], record: Optional[Dict] = None):
+        """Remember that `src` produced `outputs` (every file written for it) with the current params."""
+        st, key = os.stat(src), os.path.abspath(src)
+        old = self.entries.get(key) or {}
+        same = old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns
+        self.entries[key] = {
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": old.get("sha1") if same else None,
+            "params": self.key, "outputs": list(outputs), "record": record,
+        }
+        if self.entries[key]["sha1"] is None:
+            if self._hasher is None:
+                self._hasher = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+            self._hashing[key] = self._hasher.submit(file_sha1, src)
+        else:
+            self._hashing.pop(key, None)
+        self._touch()
+
+    def rekey(self, src: str, outputs: List[str]):
+        """Adopt an entry made with other params whose outputs are still valid under the current ones."""
+        e = self.entries.get(os.path.abspath(src))
+        if not e or e.get("params") == self.key or not all(os.path.exists(o) for o in outputs):
+            return
+        try:
+            st = os.stat(src)
+        except OSError:
+            return
+        if st.st_size == e.get("size") and st.st_mtime_ns == e.get("mtime_ns"):
+            e["params"] = self.key; self._touch()
+
+    def _touch(self):
+        self._dirty += 1
+        if self.autosave and self._dirty >= self.autosave:
+            self.save()
+
+    def save(self):
+        """Atomically rewrite the manifest (an interrupted run keeps everything up to the last save)."""
+        if not self._dirty:
+            return
+        for key, fut in self._hashing.items():
+            try:
+                self.entries[key]["sha1"] = fut.result()
+            except OSError:
+                pass  # left without a SHA-1: a later mtime change reprocesses it
+        self._hashing.clear()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "entries": self.entries}, f)
+        os.replace(tmp, self.path)
+        self._dirty = 0